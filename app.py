@@ -3,17 +3,73 @@ Main Flask application for Vectra VTU Backend
 Updated for Render.com deployment
 """
 from flask import Flask, jsonify, request
+from flask.logging import default_handler
+import atexit
 import logging
+import logging.handlers
 import os
+import orjson
+import queue
 import sys
+import threading
+import time
 from datetime import datetime
+from pathlib import Path
 
 from config import config
-from database import init_db
-from routes.airtime import airtime_bp
-from routes.data import data_bp
-from routes.webhooks import webhooks_bp
-from routes.transactions import transactions_bp
+from database import init_db, register_session_teardown
+from json_provider import OrjsonProvider
+from log_handlers import DeferredQueueHandler, FastJsonFormatter, FastRotatingFileHandler
+
+# CORS headers applied to every response (precomputed once)
+_CORS_HEADERS = (
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Headers', 'Content-Type,Authorization'),
+    ('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS'),
+    ('Access-Control-Max-Age', '86400'),
+)
+
+# Static part of the /health payload (does not change for the process lifetime)
+_STATIC_HEALTH = {
+    'status': 'healthy',
+    'service': 'Vectra VTU Backend',
+    'python_version': sys.version,
+    'environment': 'Render' if os.environ.get('RENDER') else 'Local',
+    'database': 'PostgreSQL' if os.environ.get('DATABASE_URL') else 'SQLite'
+}
+
+# [monotonic time of last refresh, cached ISO timestamp] — refreshed at most once per second
+_ts_cache = [0.0, '']
+
+# Constant response bodies, serialized once at import
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+_INDEX_BODY = orjson.dumps({
+    'service': 'Vectra VTU Backend',
+    'version': '1.0.0',
+    'status': 'running',
+    'environment': 'Render.com',
+    'endpoints': {
+        'airtime': '/api/v1/airtime',
+        'data': '/api/v1/data',
+        'webhooks': '/webhooks/iacafe',
+        'health': '/health'
+    },
+    'documentation': 'https://vectra-vtu.onrender.com/health'
+})
+_INDEX_RESP = (_INDEX_BODY, 200, _JSON_HEADERS)
+
+_NOT_FOUND_BODY = orjson.dumps({
+    'success': False,
+    'message': 'Resource not found'
+})
+_NOT_FOUND_RESP = (_NOT_FOUND_BODY, 404, _JSON_HEADERS)
+
+_INTERNAL_ERROR_BODY = orjson.dumps({
+    'success': False,
+    'message': 'Internal server error'
+})
+_INTERNAL_ERROR_RESP = (_INTERNAL_ERROR_BODY, 500, _JSON_HEADERS)
 
 def create_app():
     """Create and configure the Flask application"""
@@ -24,6 +80,9 @@ def create_app():
     # Load configuration
     app.config.from_object(config)
     
+    # Use orjson for jsonify/request.get_json
+    app.json = OrjsonProvider(app)
+    
     # Validate configuration
     try:
         config.validate_config()
@@ -35,11 +94,15 @@ def create_app():
     # CORS headers
     @app.after_request
     def after_request(response):
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+        response.headers.update(_CORS_HEADERS)
         return response
     
+    # Answer CORS preflight requests directly, without routing
+    @app.before_request
+    def handle_preflight():
+        if request.method == 'OPTIONS':
+            return '', 204, _CORS_HEADERS
+    
     # Initialize database
     with app.app_context():
         try:
@@ -48,77 +111,104 @@ def create_app():
         except Exception as e:
             app.logger.error(f"✗ Database initialization failed: {e}")
             raise
+    register_session_teardown(app)
+    
+    # Register blueprints (imported here so route/service modules load with the app)
+    def _register_blueprints():
+        from services.routes.airtime import airtime_bp
+        from services.routes.data import data_bp
+        from services.routes.webhooks import webhooks_bp
+        from services.routes.transactions import transactions_bp
+        
+        app.register_blueprint(airtime_bp)
+        app.register_blueprint(data_bp)
+        app.register_blueprint(webhooks_bp)
+        app.register_blueprint(transactions_bp)
     
-    # Register blueprints
-    app.register_blueprint(airtime_bp)
-    app.register_blueprint(data_bp)
-    app.register_blueprint(webhooks_bp)
-    app.register_blueprint(transactions_bp)
+    _register_blueprints()
     app.logger.info("✓ Blueprints registered")
     
+    # Warm the data plans cache without blocking startup
+    if config.IACAFE_PREFETCH_PLANS:
+        from services.iacafe import iacafe_service
+        threading.Thread(
+            target=iacafe_service.prefetch_all_plans,
+            name='plans-prefetch',
+            daemon=True
+        ).start()
+    
     # Configure logging
     if not app.debug:
         app.logger.setLevel(logging.INFO)
         
+        # Structured JSON lines (formatted on the listener thread)
+        formatter = FastJsonFormatter()
+        
         # Console handler (Render logs to stdout)
         console_handler = logging.StreamHandler()
         console_handler.setLevel(logging.INFO)
-        app.logger.addHandler(console_handler)
+        console_handler.setFormatter(formatter)
+        handlers = [console_handler]
+        
+        # Optional rotating log file
+        if config.LOG_FILE:
+            Path(config.LOG_FILE).parent.mkdir(parents=True, exist_ok=True)
+            file_handler = FastRotatingFileHandler(
+                config.LOG_FILE,
+                maxBytes=config.LOG_MAX_BYTES,
+                backupCount=config.LOG_BACKUP_COUNT
+            )
+            file_handler.setLevel(logging.INFO)
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+        
+        # Request threads only merge the message arguments and enqueue the
+        # record; a background listener thread does the JSON/traceback
+        # formatting and the actual console/file writes.
+        log_queue = queue.Queue(-1)
+        app.logger.removeHandler(default_handler)
+        app.logger.addHandler(DeferredQueueHandler(log_queue))
+        listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
+        )
+        listener.start()
+        atexit.register(listener.stop)
         
         app.logger.info('Vectra VTU Backend startup on Render')
     
     # Request logging middleware
+    _logger = app.logger
+    _INFO = logging.INFO
+    
     @app.before_request
     def log_request_info():
-        if request.path.startswith('/api/'):
-            app.logger.info(f"API Request: {request.method} {request.path}")
+        if _logger.isEnabledFor(_INFO) and request.path[:5] == '/api/':
+            _logger.info('API Request: %s %s', request.method, request.path)
     
     # Error handlers
     @app.errorhandler(404)
     def not_found(error):
-        return jsonify({
-            'success': False,
-            'message': 'Resource not found'
-        }), 404
+        return _NOT_FOUND_RESP
     
     @app.errorhandler(500)
     def internal_error(error):
         app.logger.error(f"Internal server error: {str(error)}")
-        return jsonify({
-            'success': False,
-            'message': 'Internal server error'
-        }), 500
+        return _INTERNAL_ERROR_RESP
     
     # Health check endpoint
     @app.route('/health', methods=['GET'])
     def health_check():
         """Health check endpoint for monitoring"""
-        return jsonify({
-            'status': 'healthy',
-            'service': 'Vectra VTU Backend',
-            'timestamp': datetime.now().isoformat(),
-            'python_version': sys.version,
-            'environment': 'Render' if os.environ.get('RENDER') else 'Local',
-            'database': 'PostgreSQL' if os.environ.get('DATABASE_URL') else 'SQLite'
-        }), 200
+        now = time.monotonic()
+        if now - _ts_cache[0] > 1.0:
+            _ts_cache[:] = [now, datetime.now().isoformat()]
+        return jsonify({**_STATIC_HEALTH, 'timestamp': _ts_cache[1]}), 200
     
     # Root endpoint
     @app.route('/', methods=['GET'])
     def index():
         """Root endpoint with API information"""
-        return jsonify({
-            'service': 'Vectra VTU Backend',
-            'version': '1.0.0',
-            'status': 'running',
-            'environment': 'Render.com',
-            'endpoints': {
-                'airtime': '/api/v1/airtime',
-                'data': '/api/v1/data',
-                'webhooks': '/webhooks/iacafe',
-                'health': '/health'
-            },
-            'documentation': 'https://vectra-vtu.onrender.com/health'
-        }), 200
+        return _INDEX_RESP
     
     app.logger.info("✓ Flask application created successfully")
     return app
@@ -4,14 +4,18 @@ Updated for better debugging
 """
 import os
 import sys
+from pathlib import Path
+
+# Project root, resolved once at import
+_BASE = Path(__file__).resolve().parent
 
 class Config:
     """Base configuration"""
     SECRET_KEY = os.getenv('SECRET_KEY', 'Vectra_secret_key_2026_1.0')
     
     # Use absolute path for SQLite database
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    SQLALCHEMY_DATABASE_URI = f'sqlite:///{os.path.join(BASE_DIR, "vectra.db")}'
+    BASE_DIR = str(_BASE)
+    SQLALCHEMY_DATABASE_URI = f'sqlite:///{_BASE / "vectra.db"}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
     # IA Café API Configuration
@@ -19,10 +23,51 @@ class Config:
     IACAFE_API_KEY = os.getenv('IACAFE_API_KEY')
     IACAFE_BASE_URL = os.getenv('IACAFE_BASE_URL', 'https://iacafe.com.ng/devapi/v1')
     IACAFE_WEBHOOK_SECRET = os.getenv('IACAFE_WEBHOOK_SECRET')
+    # Outbound proxy for IA Café calls; unset = auto (PythonAnywhere proxy there), empty = none
+    IACAFE_PROXY_URL = os.getenv('IACAFE_PROXY_URL')
+    # Connect timeout is short so an unreachable upstream fails fast;
+    # read timeout covers slow purchase processing on IA Café's side.
+    IACAFE_CONNECT_TIMEOUT = float(os.getenv('IACAFE_CONNECT_TIMEOUT', '5'))
+    IACAFE_READ_TIMEOUT = float(os.getenv('IACAFE_READ_TIMEOUT', '30'))
+    # Retries for transient failures (connection errors, timeouts, HTTP 429/5xx)
+    IACAFE_MAX_RETRIES = int(os.getenv('IACAFE_MAX_RETRIES', '2'))
+    IACAFE_BASE_DELAY = float(os.getenv('IACAFE_BASE_DELAY', '1.0'))
+    # Refuse IA Café response bodies larger than this (bytes)
+    IACAFE_MAX_RESPONSE_BYTES = int(os.getenv('IACAFE_MAX_RESPONSE_BYTES', str(1024 * 1024)))
+    # Circuit breaker: open after N consecutive failed calls, probe again after the cooldown
+    IACAFE_CB_FAILURE_THRESHOLD = int(os.getenv('IACAFE_CB_FAILURE_THRESHOLD', '5'))
+    IACAFE_CB_RECOVERY_TIMEOUT = float(os.getenv('IACAFE_CB_RECOVERY_TIMEOUT', '30'))
+    # Bulkhead: max IA Café calls in flight per process; extra calls get a 503 immediately
+    IACAFE_MAX_CONCURRENT_CALLS = int(os.getenv('IACAFE_MAX_CONCURRENT_CALLS', '16'))
+    # Data plans cache lifetime (seconds)
+    IACAFE_PLANS_CACHE_TTL = float(os.getenv('IACAFE_PLANS_CACHE_TTL', '1800'))
+    # How long /plans/<network> reuses its serialized response body (seconds)
+    PLANS_RESPONSE_CACHE_TTL = float(os.getenv('PLANS_RESPONSE_CACHE_TTL', '300'))
+    # Fetch all networks' plans in the background when the app starts
+    IACAFE_PREFETCH_PLANS = os.getenv('IACAFE_PREFETCH_PLANS', 'True').lower() == 'true'
+    
+    # Background threads per process that send purchases to IA Café
+    PURCHASE_WORKERS = int(os.getenv('PURCHASE_WORKERS', '8'))
+    
+    # Per-process replay cache for Idempotency-Key purchase responses
+    IDEMPOTENCY_CACHE_TTL = float(os.getenv('IDEMPOTENCY_CACHE_TTL', '86400'))
+    IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '10000'))
+    
+    # Per-process cache of terminal transactions (webhook/refund fast paths)
+    TRANSACTION_CACHE_SIZE = int(os.getenv('TRANSACTION_CACHE_SIZE', '10000'))
+    
+    # Per-process record of processed webhook delivery IDs
+    WEBHOOK_DELIVERY_TTL = float(os.getenv('WEBHOOK_DELIVERY_TTL', '86400'))
+    WEBHOOK_DELIVERY_CACHE_SIZE = int(os.getenv('WEBHOOK_DELIVERY_CACHE_SIZE', '100000'))
     
     # Application Settings
     DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
     
+    # Optional log file (stdout only when unset); relative paths are under the project root
+    LOG_FILE = str(_BASE / os.environ['LOG_FILE']) if os.getenv('LOG_FILE') else None
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+    
     # Debug info
     PYTHON_VERSION = f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}"
     ON_PYTHONANYWHERE = 'pythonanywhere' in os.environ.get('HOME', '')
@@ -2,8 +2,12 @@
 Database connection for Render.com (PostgreSQL) with SQLite fallback
 """
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+from contextlib import contextmanager
+from pathlib import Path
+from flask import g
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from sqlalchemy.orm import declarative_base
 import logging
 
@@ -18,45 +22,86 @@ if os.environ.get('RENDER'):
     print(f"🔧 Using PostgreSQL on Render: {DATABASE_URL[:50]}...")
 else:
     # Local SQLite database
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    DATABASE_URL = f'sqlite:///{os.path.join(BASE_DIR, "vectra.db")}'
+    _BASE = Path(__file__).resolve().parent
+    DATABASE_URL = f'sqlite:///{_BASE / "vectra.db"}'
     print(f"🔧 Using SQLite locally: {DATABASE_URL}")
 
 # Create SQLAlchemy engine
-engine = create_engine(
-    DATABASE_URL,
-    echo=False,
-    pool_size=10,
-    max_overflow=20,
-    pool_pre_ping=True,
-    connect_args={'check_same_thread': False} if 'sqlite' in DATABASE_URL else {}
-)
-
-# Create scoped session factory
-SessionLocal = scoped_session(
-    sessionmaker(
-        autocommit=False,
-        autoflush=False,
-        bind=engine
+if 'sqlite' in DATABASE_URL:
+    # SQLite has a single writer and cheap connects; pooling only holds file handles
+    engine = create_engine(
+        DATABASE_URL,
+        echo=False,
+        poolclass=NullPool,
+        connect_args={'check_same_thread': False}
+    )
+else:
+    # Recycle before Render's idle timeout drops pooled PostgreSQL connections
+    engine = create_engine(
+        DATABASE_URL,
+        echo=False,
+        pool_size=10,
+        max_overflow=20,
+        pool_pre_ping=True,
+        pool_recycle=1800
     )
+
+if 'sqlite' in DATABASE_URL:
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Use WAL journaling so readers are not blocked by writes"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA mmap_size=268435456')
+        cursor.close()
+
+# Create session factory (sessions are scoped to a request via flask.g)
+SessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=engine
 )
 
 # Create declarative base
 Base = declarative_base()
 
-def get_db():
-    """Get database session"""
+@contextmanager
+def session_scope():
+    """Session for work outside a request: commits on success, rolls back on error, always closes"""
     db = SessionLocal()
     try:
         yield db
         db.commit()
-    except Exception as e:
+    except Exception:
         db.rollback()
-        logger.error(f"Database error: {str(e)}")
         raise
     finally:
         db.close()
 
+def get_request_session():
+    """Get the database session for the current request, creating it on first use"""
+    db = g.get('_db')
+    if db is None:
+        db = g._db = SessionLocal()
+    return db
+
+def close_request_session(exc=None):
+    """Close the current request's session, if one was opened.
+
+    Handlers commit explicitly at each checkpoint (the purchase flow must
+    persist before calling the provider), so anything still uncommitted
+    here is discarded by close().
+    """
+    db = g.pop('_db', None)
+    if db is not None:
+        db.close()
+
+def register_session_teardown(app):
+    """Register per-request session teardown on the Flask app"""
+    app.teardown_request(close_request_session)
+
 def init_db():
     """Initialize database and create tables"""
     from models import Transaction
@@ -0,0 +1,26 @@
+"""
+Gunicorn configuration for Vectra VTU Backend
+
+Requests spend most of their time waiting on IA Café and the database,
+so each worker runs a thread pool (gthread) instead of serving one
+request at a time.
+"""
+import multiprocessing
+import os
+
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', str(min(32, 4 * multiprocessing.cpu_count()))))
+keepalive = 30
+preload_app = False
+
+
+def post_fork(server, worker):
+    """Give each worker its own database connections.
+
+    With --preload the app (and `init_db`) runs in the master before
+    forking; drop any pooled connections inherited from it so workers
+    never share a socket/file descriptor.
+    """
+    from database import engine
+    engine.dispose(close=False)
@@ -0,0 +1,34 @@
+"""
+orjson-backed JSON provider for Vectra VTU Backend
+"""
+import decimal
+
+import orjson
+from flask.json.provider import JSONProvider
+
+_ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    """Serialize types orjson does not handle natively."""
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider that delegates encoding/decoding to orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response (no str round-trip)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+        return self._app.response_class(body, mimetype='application/json')
@@ -0,0 +1,81 @@
+"""
+Logging handlers for Vectra VTU Backend
+"""
+import copy
+import logging
+import os
+from logging.handlers import QueueHandler, RotatingFileHandler
+
+import orjson
+
+
+class FastRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that tracks the file size in memory.
+
+    The stock handler stats the log file on every record to decide whether
+    to roll over. This keeps a running byte count instead and only falls
+    back to the filesystem check once the count reaches `maxBytes`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending = 0
+        if os.path.exists(self.baseFilename):
+            self._bytes_written = os.path.getsize(self.baseFilename)
+        else:
+            self._bytes_written = 0
+
+    def shouldRollover(self, record):
+        if self.maxBytes <= 0:
+            return False
+        self._pending = len(self.format(record)) + len(self.terminator)
+        if self._bytes_written + self._pending < self.maxBytes:
+            return False
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._bytes_written = 0
+
+    def emit(self, record):
+        self._pending = 0
+        super().emit(record)
+        self._bytes_written += self._pending
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener's handlers.
+
+    The stock prepare() runs a full format (including traceback rendering)
+    on the logging thread. This only merges the message arguments, which
+    has to happen here because they may be mutable or bound to the calling
+    thread (e.g. ORM instances), and passes exc_info through for the
+    listener's formatter.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class FastJsonFormatter(logging.Formatter):
+    """Format records as one-line JSON using orjson.
+
+    Uses the raw `record.created` epoch float instead of building an
+    `asctime` string, which keeps formatting cheap and the output easy
+    to parse in log drains.
+    """
+
+    def format(self, record):
+        entry = {
+            't': record.created,
+            'l': record.levelname,
+            'm': record.getMessage(),
+            'p': record.pathname,
+            'ln': record.lineno,
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return orjson.dumps(entry).decode()
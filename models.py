@@ -5,17 +5,19 @@ This file defines the `Transaction` model and required enums.
 """
 from datetime import datetime
 import enum
-import uuid
+import operator
+import secrets
 
 from sqlalchemy import (
     Column,
     String,
-    Float,
+    Integer,
     DateTime,
-    Enum as SQLEnum,
     JSON,
     Index,
     UniqueConstraint,
+    CheckConstraint,
+    text,
 )
 from sqlalchemy.sql import func
 from sqlalchemy.orm import validates
@@ -46,18 +48,77 @@ class NetworkType(str, enum.Enum):
     ETISALAT = '9mobile'
 
 
+def to_kobo(amount):
+    """Convert a naira amount (as received by the API) to integer kobo."""
+    return int(round(float(amount) * 100))
+
+
+# Largest naira amount whose kobo value still fits the INTEGER amount columns
+MAX_NAIRA_AMOUNT = (2 ** 31 - 1) // 100
+
+
+# Valid stored values for the string-backed enum columns
+_VALID_SERVICE_VALUES = frozenset(s.value for s in ServiceType)
+_VALID_NETWORK_VALUES = frozenset(n.value for n in NetworkType)
+_VALID_STATUS_VALUES = frozenset(s.value for s in TransactionStatus)
+
+# Statuses a transaction is finished in: webhooks, requery, refunds and the
+# lookup cache all treat these alike. SUCCESS -> REFUNDED remains a valid
+# model transition, but a webhook for a transaction in any of these states
+# (SUCCESS included) is ignored, so it never applies one.
+TERMINAL_STATUSES = frozenset((
+    TransactionStatus.SUCCESS.value,
+    TransactionStatus.FAILED.value,
+    TransactionStatus.REFUNDED.value,
+))
+
+
+def _in_check(column, values):
+    """Build a CHECK constraint expression restricting `column` to `values`."""
+    return f"{column} IN ({', '.join(repr(v) for v in sorted(values))})"
+
+
+# Fields serialized by Transaction.to_dict(), in output order
+_DICT_FIELDS = (
+    'id', 'request_id', 'user_id', 'service', 'network', 'phone', 'amount',
+    'data_plan_id', 'status', 'amount_charged', 'iacafe_reference', 'iacafe_status',
+    'error_message', 'provider_reference', 'provider_response',
+    'webhook_delivery_id', 'webhook_payload',
+)
+_DICT_DATETIME_FIELDS = ('webhook_received_at', 'created_at', 'updated_at')
+_DICT_KOBO_FIELDS = ('amount', 'amount_charged')
+_get_dict_fields = operator.attrgetter(*_DICT_FIELDS)
+_get_dict_datetime_fields = operator.attrgetter(*_DICT_DATETIME_FIELDS)
+
+
+def transaction_values_to_dict(values):
+    """Build the Transaction.to_dict() shape from plain column values (no ORM instance)."""
+    data = {key: values.get(key) for key in _DICT_FIELDS}
+    for key in _DICT_DATETIME_FIELDS:
+        value = values.get(key)
+        data[key] = value.isoformat() if value else None
+    for key in _DICT_KOBO_FIELDS:
+        value = data[key]
+        data[key] = value / 100 if value is not None else None
+    return data
+
+
 class Transaction(Base):
     """Transaction model for storing VTU transactions.
 
     Fields (mandatory):
-    - id: UUID string (primary key)
+    - id: 32-char random hex string (primary key)
     - request_id: unique request identifier (DB-level unique + index)
     - user_id: nullable, for guest/anonymous
-    - service_type: ENUM('airtime','data')
-    - network: provider network name
+    - idempotency_key: nullable client Idempotency-Key (unique per user_id and service, or
+      per service among guests)
+    - service: 'airtime' | 'data' (string + CHECK constraint)
+    - network: provider network name (string + CHECK constraint)
     - phone: destination phone number
-    - amount: numeric amount requested
-    - status: ENUM (validated at model level)
+    - amount: amount requested, in integer kobo (naira * 100)
+    - data_plan_id: IA Café data plan (data purchases only)
+    - amount_charged: amount charged to the customer, in integer kobo
+    - status: TransactionStatus value (string + CHECK, validated at model level)
     - provider_reference: nullable provider reference string
     - provider_response: nullable JSON payload from provider
     - created_at, updated_at: timestamps
@@ -65,15 +126,17 @@ class Transaction(Base):
 
     __tablename__ = 'transactions'
 
-    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    request_id = Column(String(100), nullable=False, index=True)
+    id = Column(String(36), primary_key=True, default=lambda: secrets.token_hex(16))
+    request_id = Column(String(100), nullable=False)
     user_id = Column(String(36), nullable=True, index=True)
-    service = Column(SQLEnum(ServiceType, validate_strings=True), nullable=False)
-    network = Column(SQLEnum(NetworkType, validate_strings=True), nullable=False)
+    idempotency_key = Column(String(100), nullable=True)
+    service = Column(String(16), nullable=False)
+    network = Column(String(16), nullable=False)
     phone = Column(String(32), nullable=False)
-    amount = Column(Float, nullable=False)
-    amount_charged = Column(Float, nullable=False)
-    status = Column(SQLEnum(TransactionStatus, validate_strings=True), nullable=False)
+    amount = Column(Integer, nullable=False)  # kobo
+    data_plan_id = Column(Integer, nullable=True)
+    amount_charged = Column(Integer, nullable=False)  # kobo
+    status = Column(String(16), nullable=False)
     iacafe_reference = Column(String(100), nullable=True)
     iacafe_status = Column(String(50), nullable=True)
     error_message = Column(String(500), nullable=True)
@@ -87,59 +150,78 @@ class Transaction(Base):
 
     __table_args__ = (
         UniqueConstraint('request_id', name='uq_transactions_request_id'),
-        Index('ix_transactions_user_service_status', 'user_id', 'service', 'status'),
+        # Client retries (Idempotency-Key) map back to the original row; keys
+        # are scoped per service, so an airtime key never matches a data purchase
+        UniqueConstraint('user_id', 'service', 'idempotency_key', name='uq_transactions_user_idempotency_key'),
+        # NULLs are distinct in the constraint above, so guest (no user_id)
+        # keys need their own partial unique index
+        Index(
+            'uq_transactions_guest_idempotency_key',
+            'service',
+            'idempotency_key',
+            unique=True,
+            postgresql_where=text('user_id IS NULL'),
+            sqlite_where=text('user_id IS NULL'),
+        ),
+        CheckConstraint(_in_check('service', _VALID_SERVICE_VALUES), name='ck_transactions_service'),
+        CheckConstraint(_in_check('network', _VALID_NETWORK_VALUES), name='ck_transactions_network'),
+        CheckConstraint(_in_check('status', _VALID_STATUS_VALUES), name='ck_transactions_status'),
     )
 
+    @validates('service')
+    def validate_service(self, key, value):
+        """Store service as its plain string value."""
+        value = value.value if isinstance(value, ServiceType) else value
+        if value not in _VALID_SERVICE_VALUES:
+            raise ValueError(f'Invalid service: {value}. Must be one of {sorted(_VALID_SERVICE_VALUES)}')
+        return value
+
+    @validates('network')
+    def validate_network(self, key, value):
+        """Store network as its plain string value."""
+        value = value.value if isinstance(value, NetworkType) else value
+        if value not in _VALID_NETWORK_VALUES:
+            raise ValueError(f'Invalid network: {value}. Must be one of {sorted(_VALID_NETWORK_VALUES)}')
+        return value
+
     @validates('status')
     def validate_status(self, key, value):
         """Ensure status is a valid TransactionStatus value."""
         if value is None:
             raise ValueError('status cannot be None')
-        if isinstance(value, TransactionStatus):
-            return value
-        try:
-            return TransactionStatus(value)
-        except ValueError:
-            raise ValueError(f'Invalid status: {value}. Must be one of {[s.value for s in TransactionStatus]}')
+        value = value.value if isinstance(value, TransactionStatus) else value
+        if value not in _VALID_STATUS_VALUES:
+            raise ValueError(f'Invalid status: {value}. Must be one of {sorted(_VALID_STATUS_VALUES)}')
+        return value
 
     def to_dict(self):
-        return {
-            'id': self.id,
-            'request_id': self.request_id,
-            'user_id': self.user_id,
-            'service': self.service.value if self.service else None,
-            'network': self.network,
-            'phone': self.phone,
-            'amount': self.amount,
-            'status': self.status.value if self.status else None,
-            'amount_charged': self.amount_charged,
-            'iacafe_reference': self.iacafe_reference,
-            'iacafe_status': self.iacafe_status,
-            'error_message': self.error_message,
-            'provider_reference': self.provider_reference,
-            'provider_response': self.provider_response,
-            'webhook_delivery_id': self.webhook_delivery_id,
-            'webhook_payload': self.webhook_payload,
-            'webhook_received_at': self.webhook_received_at.isoformat() if self.webhook_received_at else None,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-        }
+        data = dict(zip(_DICT_FIELDS, _get_dict_fields(self)))
+        for key, value in zip(_DICT_DATETIME_FIELDS, _get_dict_datetime_fields(self)):
+            data[key] = value.isoformat() if value else None
+        # Amounts are stored in kobo but exposed in naira
+        for key in _DICT_KOBO_FIELDS:
+            value = data[key]
+            data[key] = value / 100 if value is not None else None
+        return data
 
     def __repr__(self):
-        return f"<Transaction {self.request_id} {self.service_type.value} {self.status.value}>"
+        return f"<Transaction {self.request_id} {self.service} {self.status}>"
 
 
 # Allowed lifecycle transitions
 _ALLOWED_STATUS_TRANSITIONS = {
-    TransactionStatus.INITIATED.value: {TransactionStatus.PROCESSING.value},
-    TransactionStatus.PROCESSING.value: {TransactionStatus.SUCCESS.value, TransactionStatus.FAILED.value},
-    TransactionStatus.SUCCESS.value: {TransactionStatus.REFUNDED.value},
-    TransactionStatus.FAILED.value: set(),
-    TransactionStatus.REFUNDED.value: set(),
+    TransactionStatus.INITIATED.value: frozenset({TransactionStatus.PROCESSING.value}),
+    TransactionStatus.PROCESSING.value: frozenset({TransactionStatus.SUCCESS.value, TransactionStatus.FAILED.value}),
+    TransactionStatus.SUCCESS.value: frozenset({TransactionStatus.REFUNDED.value}),
+    TransactionStatus.FAILED.value: frozenset(),
+    TransactionStatus.REFUNDED.value: frozenset(),
 }
 
 
-@event.listens_for(Transaction.status, 'set', retval=True)
+# active_history loads the persisted value when the instance has been
+# expired (e.g. after commit), so `oldvalue` is the real current status
+# rather than NO_VALUE.
+@event.listens_for(Transaction.status, 'set', retval=True, active_history=True)
 def _validate_status_transition(target, value, oldvalue, initiator):
     """Reject invalid status transitions globally.
 
@@ -152,10 +234,10 @@ def _validate_status_transition(target, value, oldvalue, initiator):
     - Any invalid transition raises ValueError.
     """
     # Normalize incoming values to strings
-    new = value.value if isinstance(value, TransactionStatus) else value
+    new = value.value if value.__class__ is TransactionStatus else value
 
     # Validate new is a known status
-    if new not in {s.value for s in TransactionStatus}:
+    if new not in _VALID_STATUS_VALUES:
         raise ValueError(f"Invalid status value: {new}")
 
     # Allow initial set only to INITIATED
@@ -165,7 +247,7 @@ def _validate_status_transition(target, value, oldvalue, initiator):
         return value
 
     # No-op if unchanged
-    old = oldvalue.value if isinstance(oldvalue, TransactionStatus) else oldvalue
+    old = oldvalue.value if oldvalue.__class__ is TransactionStatus else oldvalue
     if old == new:
         return value
 
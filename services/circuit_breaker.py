@@ -0,0 +1,129 @@
+"""
+Circuit breaker and bulkhead for outbound provider calls
+Fails fast while an upstream is known to be down (or already saturated
+with in-flight calls) instead of waiting for every request to time out
+"""
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit is open"""
+
+    def __init__(self, name: str, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"{name} circuit is open; retry after {retry_after:.0f}s")
+
+
+class BulkheadFullError(CircuitOpenError):
+    """Raised when every call slot is taken; callers treat it like an open circuit"""
+
+    def __init__(self, name: str, max_concurrent: int):
+        self.retry_after = 1.0
+        Exception.__init__(self, f"{name} bulkhead is full ({max_concurrent} calls in flight)")
+
+
+class CircuitBreaker:
+    """Thread-safe CLOSED / OPEN / HALF_OPEN circuit breaker.
+
+    - CLOSED: calls pass through; consecutive failures are counted.
+    - OPEN: after `failure_threshold` consecutive failures, calls are
+      rejected with CircuitOpenError for `recovery_timeout` seconds.
+    - HALF_OPEN: after the cooldown a single trial call is let through;
+      success closes the circuit, failure re-opens it.
+    """
+
+    CLOSED = 'CLOSED'
+    OPEN = 'OPEN'
+    HALF_OPEN = 'HALF_OPEN'
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def _current_state(self) -> str:
+        # Caller must hold self._lock
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def _retry_after(self) -> float:
+        # Caller must hold self._lock
+        if self._state == self.OPEN:
+            return max(1.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+        return 1.0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def is_open(self) -> bool:
+        """True while calls would be rejected"""
+        with self._lock:
+            state = self._current_state()
+            return state == self.OPEN or (state == self.HALF_OPEN and self._trial_in_flight)
+
+    def retry_after(self) -> float:
+        """Seconds until a call may be attempted again"""
+        with self._lock:
+            self._current_state()
+            return self._retry_after()
+
+    def before_call(self):
+        """Reserve a call slot or raise CircuitOpenError"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.OPEN:
+                raise CircuitOpenError(self.name, self._retry_after())
+            if state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    raise CircuitOpenError(self.name, self._retry_after())
+                self._trial_in_flight = True
+
+    def cancel_call(self):
+        """Give back a slot reserved by before_call() when the call was not made"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._trial_in_flight = False
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class Bulkhead:
+    """Caps concurrent calls to an upstream so a slow provider cannot tie up
+    every worker thread. Request threads fail fast with BulkheadFullError
+    when the cap is reached; callers from an already bounded pool (the
+    background purchase workers) may instead wait for a slot.
+    """
+
+    def __init__(self, name: str, max_concurrent: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    def acquire(self, wait: bool = False):
+        """Take a call slot; without `wait`, raise BulkheadFullError if none is free"""
+        if not self._slots.acquire(blocking=wait):
+            raise BulkheadFullError(self.name, self.max_concurrent)
+
+    def release(self):
+        self._slots.release()
@@ -4,18 +4,56 @@ Handles all communication with IA Café VTU API
 Updated for PythonAnywhere compatibility
 """
 import requests
+from requests.adapters import HTTPAdapter
+import atexit
 import uuid
 import logging
 import os
+import orjson
+import random
 import sys
-import json
-from typing import Dict, Any, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Callable, Dict, Any, Optional
 from datetime import datetime
 
 from config import config
+from services.circuit_breaker import Bulkhead, CircuitBreaker
 
 logger = logging.getLogger(__name__)
 
+class IACafeHTTPError(Exception):
+    """IA Café answered with an HTTP error status"""
+    
+    def __init__(self, status_code: int, message: str):
+        self.status_code = status_code
+        super().__init__(message)
+
+
+# Transport errors worth retrying (SSLError/ProxyError are handled separately first)
+_RETRYABLE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+# IA Café order status -> internal status (anything else is still pending)
+_STATUS_MAP = MappingProxyType({
+    'processing-api': 'PENDING',
+    'completed-api': 'SUCCESS',
+    'refunded': 'REFUNDED',
+    'unprocessable': 'FAILED',
+    '422': 'FAILED'
+})
+_STATUS_MAP_GET = _STATUS_MAP.get
+
+# How much of an HTTP error body to keep for logs/exception messages
+_ERROR_BODY_PREVIEW = 2048
+
+# Outbound proxy for PythonAnywhere free-tier accounts
+_PYTHONANYWHERE_PROXY = 'http://proxy.server:3128'
+
 class IACafeService:
     """Service for interacting with IA Café VTU API"""
     
@@ -23,6 +61,23 @@ class IACafeService:
         """Initialize IA Café service with API credentials"""
         self.base_url = config.IACAFE_BASE_URL
         self.api_key = config.IACAFE_API_KEY
+        self.timeout = (config.IACAFE_CONNECT_TIMEOUT, config.IACAFE_READ_TIMEOUT)
+        self.max_retries = config.IACAFE_MAX_RETRIES
+        self.base_delay = config.IACAFE_BASE_DELAY
+        self.max_response_bytes = config.IACAFE_MAX_RESPONSE_BYTES
+        self.circuit_breaker = CircuitBreaker(
+            'IA Café',
+            failure_threshold=config.IACAFE_CB_FAILURE_THRESHOLD,
+            recovery_timeout=config.IACAFE_CB_RECOVERY_TIMEOUT
+        )
+        self.bulkhead = Bulkhead('IA Café', config.IACAFE_MAX_CONCURRENT_CALLS)
+        
+        # Data plans change slowly: cache them per network_id as
+        # {network_id: (fetched_at, response)} and keep expired entries
+        # around as a fallback for when IA Café is failing.
+        self.plans_cache_ttl = config.IACAFE_PLANS_CACHE_TTL
+        self._plans_cache = {}
+        self._plans_cache_lock = threading.Lock()
         
         print(f"🔧 Initializing IA Café Service...")
         print(f"   Base URL: {self.base_url}")
@@ -52,8 +107,23 @@ class IACafeService:
             '9mobile': '9mobile'
         }
         
-        # Configure proxies for PythonAnywhere
+        # Configure proxies for PythonAnywhere (probed lazily on ProxyError)
         self.proxies = self._configure_proxies()
+        self._proxies_probed = False
+        
+        # Persistent HTTP session (connection pooling + keep-alive)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.proxies = self.proxies
+        # One host, so one pool; size it to the bulkhead so every in-flight call
+        # can return its connection (extra connections would be discarded after use).
+        # Retries are handled in _send_request, so urllib3 must not retry as well.
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=config.IACAFE_MAX_CONCURRENT_CALLS,
+            max_retries=0
+        ))
+        atexit.register(self.session.close)
         
         print(f"   PythonAnywhere detected: {'Yes' if 'pythonanywhere' in os.environ.get('HOME', '') else 'No'}")
         print(f"   Proxies configured: {bool(self.proxies)}")
@@ -61,48 +131,136 @@ class IACafeService:
     
     def _configure_proxies(self) -> Dict:
         """
-        Configure proxies for PythonAnywhere environment
-        PythonAnywhere free tier blocks most outbound HTTPS connections
-        """
-        proxies = {}
+        Configure proxies without touching the network
         
-        # Check if we're on PythonAnywhere
-        if 'pythonanywhere' in os.environ.get('HOME', ''):
+        IACAFE_PROXY_URL wins when set (empty = no proxy). Otherwise
+        PythonAnywhere gets its standard outbound proxy, since the free tier
+        blocks most direct HTTPS connections.
+        """
+        proxy_url = config.IACAFE_PROXY_URL
+        if proxy_url is None and 'pythonanywhere' in os.environ.get('HOME', ''):
             print("   🐍 PythonAnywhere environment detected")
+            proxy_url = _PYTHONANYWHERE_PROXY
+        
+        if not proxy_url:
+            return {}
+        return {'http': proxy_url, 'https': proxy_url}
+    
+    def _probe_proxies(self) -> Dict:
+        """
+        Find a working proxy by test-fetching a known URL through each option
+        
+        Only run after a ProxyError, never at import time.
+        """
+        for proxy_url in (config.IACAFE_PROXY_URL, _PYTHONANYWHERE_PROXY):
+            if not proxy_url:
+                continue
+            proxies = {
+                'http': proxy_url,
+                'https': proxy_url,
+            }
+            logger.info(f"Trying proxy: {proxy_url}")
+            try:
+                test_response = requests.get('https://www.pythonanywhere.com', proxies=proxies, timeout=5)
+                if test_response.status_code == 200:
+                    logger.info(f"Proxy {proxy_url} works")
+                    return proxies
+            except requests.exceptions.RequestException:
+                continue
+        
+        logger.warning("No working proxy found, continuing without proxy")
+        return {}
+    
+    def _is_retryable_status(self, status_code: int) -> bool:
+        """Whether an HTTP status indicates a transient upstream failure"""
+        return status_code == 429 or status_code >= 500
+    
+    def _backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff (capped at 30s) with up to 50% jitter"""
+        return min(30.0, self.base_delay * 2 ** attempt) * (1 + random.uniform(0, 0.5))
+    
+    def _read_body(self, response, limit: int, truncate: bool = False) -> bytes:
+        """
+        Read a streamed response body without holding more than limit bytes
+        
+        Args:
+            response: Response opened with stream=True (closed afterwards)
+            limit: Maximum number of body bytes to keep
+            truncate: Return the first limit bytes instead of raising
             
-            # Try different proxy configurations
-            proxy_options = [
-                'http://proxy.server:3128',  # Common PythonAnywhere proxy
-                None,  # No proxy (sometimes works for whitelisted domains)
-            ]
-            
-            # Test which proxy works
-            for proxy_url in proxy_options:
-                if proxy_url:
-                    proxies = {
-                        'http': proxy_url,
-                        'https': proxy_url,
-                    }
-                    print(f"   🔄 Trying proxy: {proxy_url}")
-                    
-                    # Test connection
-                    test_url = 'https://www.pythonanywhere.com'
-                    try:
-                        test_response = requests.get(test_url, proxies=proxies, timeout=5)
-                        if test_response.status_code == 200:
-                            print(f"   ✅ Proxy {proxy_url} works!")
-                            return proxies
-                    except:
-                        continue
+        Raises:
+            Exception: If the body exceeds limit and truncate is False
+        """
+        try:
+            declared = response.headers.get('Content-Length')
+            if not truncate and declared and declared.isdigit() and int(declared) > limit:
+                raise Exception(f"IA Café response too large: {declared} bytes (limit {limit})")
             
-            print("   ⚠️ No working proxy found, trying without proxy")
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                body += chunk
+                if len(body) > limit:
+                    if truncate:
+                        return bytes(body[:limit])
+                    raise Exception(f"IA Café response exceeded {limit} bytes")
+            return bytes(body)
+        finally:
+            response.close()
+    
+    def _make_request(self, method: str, endpoint: str, data: Dict = None,
+                      wait_for_slot: bool = False,
+                      before_send: Optional[Callable[[], bool]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Make HTTP request to IA Café API through the bulkhead and circuit breaker
         
-        return {}
+        Args:
+            wait_for_slot: Block until a bulkhead slot is free instead of
+                failing fast (for the bounded background purchase workers)
+            before_send: Called once the call has been admitted, right before
+                it is sent; if it returns False (or raises) nothing is sent
+                and None is returned (or the error propagates)
+        
+        Raises:
+            CircuitOpenError: If IA Café is failing and calls are short-circuited
+                (BulkheadFullError if too many calls are already in flight)
+            Exception: If API request fails
+        """
+        self.bulkhead.acquire(wait=wait_for_slot)
+        try:
+            self.circuit_breaker.before_call()
+            if before_send is not None:
+                try:
+                    proceed = before_send()
+                except Exception:
+                    self.circuit_breaker.cancel_call()
+                    raise
+                if not proceed:
+                    self.circuit_breaker.cancel_call()
+                    return None
+            try:
+                result = self._send_request(method, endpoint, data)
+            except IACafeHTTPError as e:
+                # A 4xx means IA Café is up and rejected this request
+                if e.status_code >= 500 or e.status_code == 429:
+                    self.circuit_breaker.record_failure()
+                else:
+                    self.circuit_breaker.record_success()
+                raise
+            except Exception:
+                self.circuit_breaker.record_failure()
+                raise
+            self.circuit_breaker.record_success()
+            return result
+        finally:
+            self.bulkhead.release()
     
-    def _make_request(self, method: str, endpoint: str, data: Dict = None) -> Dict[str, Any]:
+    def _send_request(self, method: str, endpoint: str, data: Dict = None) -> Dict[str, Any]:
         """
         Make HTTP request to IA Café API with error handling
         
+        Connection errors, timeouts and HTTP 429/5xx responses are retried
+        with exponential backoff; other 4xx, SSL and proxy errors are not.
+        
         Args:
             method: HTTP method (GET, POST)
             endpoint: API endpoint
@@ -116,105 +274,105 @@ class IACafeService:
         """
         url = f"{self.base_url}{endpoint}"
         
-        print(f"\n🌐 Making {method} request to IA Café API")
-        print(f"   URL: {url}")
-        print(f"   Endpoint: {endpoint}")
-        if data:
-            print(f"   Payload: {json.dumps(data, indent=2)}")
-        
-        try:
-            logger.info(f"Making {method} request to {endpoint}")
-            
-            request_kwargs = {
-                'headers': self.headers,
-                'timeout': 30,
-                'proxies': self.proxies
-            }
-            
-            if method.upper() == 'GET':
-                if data:
-                    request_kwargs['params'] = data
-                response = requests.get(url, **request_kwargs)
-            else:  # POST
-                if data:
-                    request_kwargs['json'] = data
-                response = requests.post(url, **request_kwargs)
-            
-            print(f"   Status Code: {response.status_code}")
-            print(f"   Response Headers: {dict(response.headers)}")
-            
-            try:
-                response.raise_for_status()
-            except requests.exceptions.HTTPError:
-                # Provide the response body for diagnostics (without leaking secrets)
-                status = response.status_code
-                text = response.text
-                logger.error(f"IA Café HTTP error {status}: {text}")
-                raise Exception(f"IA Café API request failed: {status} {text}")
-
-            result = response.json()
-            print(f"✅ API Response: {json.dumps(result, indent=2)}")
-            logger.info(f"API Response: {result}")
-
-            return result
-            
-        except requests.exceptions.ConnectTimeout as e:
-            error_msg = f"Connection timeout to IA Café API: {str(e)}"
-            print(f"❌ {error_msg}")
-            logger.error(error_msg)
-            raise Exception(error_msg)
-            
-        except requests.exceptions.SSLError as e:
-            error_msg = f"SSL error with IA Café API: {str(e)}"
-            print(f"❌ {error_msg}")
-            logger.error(error_msg)
-            # Try without SSL verification as last resort
-            print("🔄 Retrying without SSL verification...")
+        # Retries are safe: every call carries the caller's request_id,
+        # which IA Café uses to deduplicate.
+        for attempt in range(self.max_retries + 1):
             try:
-                if method.upper() == 'GET':
-                    response = requests.get(url, headers=self.headers, params=data, timeout=30, verify=False)
-                else:
-                    response = requests.post(url, headers=self.headers, json=data, timeout=30, verify=False)
+                logger.debug("Making %s request to %s payload=%s", method, endpoint, data)
+                
+                request_kwargs = {
+                    'timeout': self.timeout,
+                    'stream': True
+                }
                 
-                result = response.json()
-                print(f"✅ API Response (no SSL): {json.dumps(result, indent=2)}")
-                return result
-            except Exception as retry_error:
-                raise Exception(f"IA Café API request failed even without SSL: {str(retry_error)}")
-            
-        except requests.exceptions.ProxyError as e:
-            error_msg = f"Proxy error: {str(e)}"
-            print(f"❌ {error_msg}")
-            logger.error(error_msg)
-            print("🔄 Retrying without proxy...")
-            # Try without proxy
-            try:
                 if method.upper() == 'GET':
-                    response = requests.get(url, headers=self.headers, params=data, timeout=30)
-                else:
-                    response = requests.post(url, headers=self.headers, json=data, timeout=30)
+                    if data:
+                        request_kwargs['params'] = data
+                    response = self.session.get(url, **request_kwargs)
+                else:  # POST
+                    if data:
+                        request_kwargs['json'] = data
+                    response = self.session.post(url, **request_kwargs)
                 
-                result = response.json()
-                print(f"✅ API Response (no proxy): {json.dumps(result, indent=2)}")
+                logger.debug("IA Café responded %s for %s", response.status_code, endpoint)
+                
+                # Transient upstream failure: back off and retry
+                if self._is_retryable_status(response.status_code) and attempt < self.max_retries:
+                    delay = self._backoff_delay(attempt)
+                    logger.warning(f"IA Café returned {response.status_code} for {endpoint}; retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+                    # Drain the (small) error body so the connection goes back to the pool
+                    self._read_body(response, _ERROR_BODY_PREVIEW, truncate=True)
+                    time.sleep(delay)
+                    continue
+                
+                try:
+                    response.raise_for_status()
+                except requests.exceptions.HTTPError:
+                    # Provide the response body for diagnostics (without leaking secrets)
+                    status = response.status_code
+                    text = self._read_body(response, _ERROR_BODY_PREVIEW, truncate=True).decode('utf-8', 'replace')
+                    logger.error(f"IA Café HTTP error {status}: {text}")
+                    raise IACafeHTTPError(status, f"IA Café API request failed: {status} {text}")
+
+                result = orjson.loads(self._read_body(response, self.max_response_bytes))
+                logger.debug("API Response: %s", result)
+
                 return result
-            except Exception as retry_error:
-                raise Exception(f"IA Café API request failed: {str(retry_error)}")
-            
-        except requests.exceptions.RequestException as e:
-            error_msg = f"API Request failed: {str(e)}"
-            print(f"❌ {error_msg}")
-            logger.error(error_msg)
-            
-            # Diagnostic information
-            print("\n🔍 Diagnostic Information:")
-            print(f"   Python Version: {sys.version}")
-            print(f"   Requests Version: {requests.__version__}")
-            print(f"   Platform: {sys.platform}")
-            print(f"   PythonAnywhere: {'pythonanywhere' in os.environ.get('HOME', '')}")
-            
-            raise Exception(f"IA Café API request failed: {str(e)}")
+                
+            except requests.exceptions.SSLError as e:
+                # Certificate/handshake failures are not transient; never fall back to verify=False
+                error_msg = f"SSL error with IA Café API: {str(e)}"
+                logger.error(error_msg)
+                raise Exception(error_msg)
+                
+            except requests.exceptions.ProxyError as e:
+                error_msg = f"Proxy error: {str(e)}"
+                logger.error(error_msg)
+                # Re-check the proxy once, on the first proxy failure
+                if not self._proxies_probed:
+                    self._proxies_probed = True
+                    self.proxies = self._probe_proxies()
+                    self.session.proxies = self.proxies
+                logger.warning("Retrying with proxies=%s", self.proxies or None)
+                # None values drop the session-level proxies
+                retry_proxies = self.proxies or {'http': None, 'https': None}
+                try:
+                    if method.upper() == 'GET':
+                        response = self.session.get(url, params=data, timeout=self.timeout, proxies=retry_proxies, stream=True)
+                    else:
+                        response = self.session.post(url, json=data, timeout=self.timeout, proxies=retry_proxies, stream=True)
+                
+                    result = orjson.loads(self._read_body(response, self.max_response_bytes))
+                    logger.debug("API Response (no proxy): %s", result)
+                    return result
+                except Exception as retry_error:
+                    raise Exception(f"IA Café API request failed: {str(retry_error)}")
+                
+            except _RETRYABLE_ERRORS as e:
+                if attempt < self.max_retries:
+                    delay = self._backoff_delay(attempt)
+                    logger.warning(f"Transient IA Café error for {endpoint}: {str(e)}; retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+                    time.sleep(delay)
+                    continue
+                error_msg = f"IA Café API unreachable after {attempt + 1} attempts: {str(e)}"
+                logger.error(error_msg)
+                raise Exception(error_msg)
+                
+            except requests.exceptions.RequestException as e:
+                error_msg = f"API Request failed: {str(e)}"
+                logger.error(error_msg)
+                
+                # Diagnostic information
+                logger.debug(
+                    "Diagnostics: python=%s requests=%s platform=%s pythonanywhere=%s",
+                    sys.version, requests.__version__, sys.platform,
+                    'pythonanywhere' in os.environ.get('HOME', '')
+                )
+                
+                raise Exception(f"IA Café API request failed: {str(e)}")
     
-    def purchase_airtime(self, request_id: str, phone: str, network: str, amount: float) -> Dict[str, Any]:
+    def purchase_airtime(self, request_id: str, phone: str, network: str, amount: float,
+                         before_send: Optional[Callable[[], bool]] = None) -> Optional[Dict[str, Any]]:
         """
         Purchase airtime via IA Café API
         
@@ -223,20 +381,17 @@ class IACafeService:
             phone: Recipient phone number
             network: Network provider
             amount: Amount to purchase
+            before_send: See _make_request
             
         Returns:
-            Dict containing API response
+            Dict containing API response (None if before_send declined the call)
         """
-        print(f"\n🛒 Purchasing Airtime")
-        print(f"   Request ID: {request_id}")
-        print(f"   Phone: {phone}")
-        print(f"   Network: {network}")
-        print(f"   Amount: ₦{amount}")
+        logger.debug("Purchasing airtime request_id=%s phone=%s network=%s amount=%s",
+                     request_id, phone, network, amount)
         
         # Validate network
         if network not in self.service_id_map:
             error_msg = f"Invalid network: {network}"
-            print(f"❌ {error_msg}")
             raise ValueError(error_msg)
         
         payload = {
@@ -246,14 +401,14 @@ class IACafeService:
             "amount": amount
         }
         
-        print(f"   Payload: {json.dumps(payload, indent=2)}")
-        
         try:
-            response = self._make_request('POST', '/airtime', payload)
+            # Called from the bounded purchase pool: queue for a slot rather than
+            # failing a transaction that has already been accepted
+            response = self._make_request('POST', '/airtime', payload, wait_for_slot=True,
+                                          before_send=before_send)
             return response
         except Exception as e:
             error_msg = f"Airtime purchase failed: {str(e)}"
-            print(f"❌ {error_msg}")
             logger.error(error_msg)
             raise
     
@@ -261,41 +416,66 @@ class IACafeService:
         """
         Get available data plans for a network
         
+        Successful responses are cached for IACAFE_PLANS_CACHE_TTL seconds.
+        If IA Café fails, the last cached response is returned with
+        'stale': True instead of raising.
+        
         Args:
             network_id: Network ID (1-4)
             
         Returns:
             Dict containing data plans
         """
-        print(f"\n📊 Fetching Data Plans")
-        print(f"   Network ID: {network_id}")
-        
         if not 1 <= network_id <= 4:
             error_msg = f"Network ID must be between 1 and 4, got {network_id}"
-            print(f"❌ {error_msg}")
             raise ValueError(error_msg)
         
+        cached = self._plans_cache.get(network_id)
+        if cached and time.monotonic() - cached[0] < self.plans_cache_ttl:
+            return dict(cached[1])
+        
+        logger.debug("Fetching data plans network_id=%s", network_id)
+        
         try:
             response = self._make_request('GET', f'/budget-data/plans?network_id={network_id}')
-            
-            if response.get('success'):
-                plans = response.get('data', [])
-                print(f"✅ Found {len(plans)} data plans")
-                for plan in plans[:5]:  # Show first 5 plans
-                    print(f"   - {plan.get('name')}: ₦{plan.get('price')}")
-                if len(plans) > 5:
-                    print(f"   ... and {len(plans) - 5} more")
-            else:
-                print(f"⚠️ API returned success=False: {response.get('message')}")
-            
-            return response
         except Exception as e:
+            if cached:
+                logger.warning(f"Failed to fetch data plans for network {network_id}, serving cached copy: {str(e)}")
+                return {**cached[1], 'stale': True}
             error_msg = f"Failed to fetch data plans: {str(e)}"
-            print(f"❌ {error_msg}")
             logger.error(error_msg)
             raise
+        
+        if response.get('success'):
+            logger.debug("Found %d data plans", len(response.get('data', [])))
+            with self._plans_cache_lock:
+                self._plans_cache[network_id] = (time.monotonic(), response)
+        else:
+            logger.warning("IA Café returned success=False for plans: %s", response.get('message'))
+        
+        return dict(response)
     
-    def purchase_data(self, request_id: str, phone: str, network: str, data_plan_id: int) -> Dict[str, Any]:
+    def prefetch_all_plans(self) -> Dict[int, bool]:
+        """
+        Warm the data plans cache for every network concurrently
+        
+        Returns:
+            Dict mapping network_id to whether its plans were fetched
+        """
+        network_ids = list(self.network_id_map.values())
+        
+        def fetch(network_id):
+            try:
+                return bool(self.get_data_plans(network_id).get('success'))
+            except Exception as e:
+                logger.warning(f"Could not prefetch data plans for network {network_id}: {str(e)}")
+                return False
+        
+        with ThreadPoolExecutor(max_workers=len(network_ids)) as pool:
+            return dict(zip(network_ids, pool.map(fetch, network_ids)))
+    
+    def purchase_data(self, request_id: str, phone: str, network: str, data_plan_id: int,
+                      before_send: Optional[Callable[[], bool]] = None) -> Optional[Dict[str, Any]]:
         """
         Purchase data plan via IA Café API
         
@@ -304,20 +484,17 @@ class IACafeService:
             phone: Recipient phone number
             network: Network provider
             data_plan_id: Data plan ID from IA Café
+            before_send: See _make_request
             
         Returns:
-            Dict containing API response
+            Dict containing API response (None if before_send declined the call)
         """
-        print(f"\n🛒 Purchasing Data Plan")
-        print(f"   Request ID: {request_id}")
-        print(f"   Phone: {phone}")
-        print(f"   Network: {network}")
-        print(f"   Data Plan ID: {data_plan_id}")
+        logger.debug("Purchasing data request_id=%s phone=%s network=%s data_plan_id=%s",
+                     request_id, phone, network, data_plan_id)
         
         # Validate network
         if network not in self.network_id_map:
             error_msg = f"Invalid network: {network}"
-            print(f"❌ {error_msg}")
             raise ValueError(error_msg)
         
         payload = {
@@ -327,14 +504,14 @@ class IACafeService:
             "network_id": self.network_id_map[network]
         }
         
-        print(f"   Payload: {json.dumps(payload, indent=2)}")
-        
         try:
-            response = self._make_request('POST', '/budget-data', payload)
+            # Called from the bounded purchase pool: queue for a slot rather than
+            # failing a transaction that has already been accepted
+            response = self._make_request('POST', '/budget-data', payload, wait_for_slot=True,
+                                          before_send=before_send)
             return response
         except Exception as e:
             error_msg = f"Data purchase failed: {str(e)}"
-            print(f"❌ {error_msg}")
             logger.error(error_msg)
             raise
     
@@ -348,15 +525,13 @@ class IACafeService:
         Returns:
             Dict containing order status
         """
-        print(f"\n📋 Checking Order Status")
-        print(f"   Request ID: {request_id}")
+        logger.debug("Checking order status request_id=%s", request_id)
         
         try:
             response = self._make_request('GET', f'/orders/{request_id}')
             return response
         except Exception as e:
             error_msg = f"Failed to get order status: {str(e)}"
-            print(f"❌ {error_msg}")
             logger.error(error_msg)
             raise
     
@@ -370,8 +545,7 @@ class IACafeService:
         Returns:
             Dict containing requery response
         """
-        print(f"\n🔄 Requerying Order")
-        print(f"   Request ID: {request_id}")
+        logger.debug("Requerying order request_id=%s", request_id)
         
         payload = {"request_id": request_id}
         
@@ -380,7 +554,6 @@ class IACafeService:
             return response
         except Exception as e:
             error_msg = f"Requery failed: {str(e)}"
-            print(f"❌ {error_msg}")
             logger.error(error_msg)
             raise
     
@@ -394,17 +567,11 @@ class IACafeService:
         Returns:
             Normalized status string
         """
-        status_map = {
-            'processing-api': 'PENDING',
-            'completed-api': 'SUCCESS',
-            'refunded': 'REFUNDED',
-            'unprocessable': 'FAILED',
-            '422': 'FAILED'
-        }
-        
-        normalized = status_map.get(iacafe_status, 'PENDING')
-        print(f"📊 Status Normalization: '{iacafe_status}' → '{normalized}'")
-        return normalized
+        return _STATUS_MAP_GET(iacafe_status, 'PENDING')
+    
+    def _ping(self) -> Dict[str, Any]:
+        """Cheapest authenticated round trip: MTN plans, bypassing the plans cache"""
+        return self._make_request('GET', '/budget-data/plans?network_id=1')
     
     def test_connection(self) -> bool:
         """
@@ -417,9 +584,8 @@ class IACafeService:
         print(f"   URL: {self.base_url}")
         
         try:
-            # Try to get data plans for MTN (network_id=1)
-            response = self.get_data_plans(1)
-            success = response.get('success', False)
+            response = self._ping()
+            success = bool(response.get('success'))
             print(f"   Connection test: {'✅ SUCCESS' if success else '❌ FAILED'}")
             if not success:
                 print(f"   Error: {response.get('message', 'Unknown error')}")
@@ -0,0 +1,72 @@
+"""
+Per-process idempotency caches
+- Idempotency-Key response replay: a client retry with the same key (per
+  user and service) gets the original purchase response without touching
+  the DB, as long as it describes the same purchase
+- Webhook delivery claims: a redelivered X-VTU-Delivery ID is ignored
+  without a transaction lookup
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from config import config
+
+# {(user_id, service, key): (stored_at, fingerprint, body, status)}, oldest first
+_responses = OrderedDict()
+# {delivery_id: claimed_at}, oldest first
+_deliveries = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_response(user_id: Optional[str], service: str, key: str) -> Optional[Tuple[tuple, bytes, int]]:
+    """Return the stored (fingerprint, body, status) for this key, or None
+
+    The caller compares the fingerprint (the purchase fields the key was
+    first used with) against the retry before replaying the body.
+    """
+    cache_key = (user_id, service, key)
+    with _lock:
+        entry = _responses.get(cache_key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= config.IDEMPOTENCY_CACHE_TTL:
+            del _responses[cache_key]
+            return None
+        return entry[1], entry[2], entry[3]
+
+
+def store_response(user_id: Optional[str], service: str, key: str, fingerprint: tuple,
+                   body: bytes, status: int) -> None:
+    """Remember the response for this key, evicting the oldest entries past the size cap"""
+    cache_key = (user_id, service, key)
+    with _lock:
+        _responses[cache_key] = (time.monotonic(), fingerprint, body, status)
+        _responses.move_to_end(cache_key)
+        while len(_responses) > config.IDEMPOTENCY_CACHE_SIZE:
+            _responses.popitem(last=False)
+
+
+def claim_delivery(delivery_id: str) -> bool:
+    """Claim a webhook delivery ID (SET NX EX semantics); False if already claimed"""
+    now = time.monotonic()
+    # Lock-free fast path for redeliveries (a single dict read is atomic)
+    claimed_at = _deliveries.get(delivery_id)
+    if claimed_at is not None and now - claimed_at < config.WEBHOOK_DELIVERY_TTL:
+        return False
+    with _lock:
+        claimed_at = _deliveries.get(delivery_id)
+        if claimed_at is not None and now - claimed_at < config.WEBHOOK_DELIVERY_TTL:
+            return False
+        _deliveries[delivery_id] = now
+        _deliveries.move_to_end(delivery_id)
+        while len(_deliveries) > config.WEBHOOK_DELIVERY_CACHE_SIZE:
+            _deliveries.popitem(last=False)
+        return True
+
+
+def release_delivery(delivery_id: str) -> None:
+    """Drop a claim so a redelivery is processed again (used when processing fails)"""
+    with _lock:
+        _deliveries.pop(delivery_id, None)
@@ -3,14 +3,22 @@ Airtime purchase routes for Vectra VTU Backend
 Handles airtime purchase requests and responses
 """
 from flask import Blueprint, request, jsonify
-import uuid
+import math
 import logging
-from datetime import datetime
+import msgspec
+import orjson
+from typing import Annotated, Optional
 
-from models import Transaction, TransactionStatus, ServiceType, NetworkType
+from models import MAX_NAIRA_AMOUNT, TransactionStatus, ServiceType, NetworkType, to_kobo
 from services.iacafe import iacafe_service
-from services.transaction_service import change_transaction_status
-from database import get_db
+from services.transaction_service import (
+    generate_request_id, get_by_idempotency_key, get_by_request_id, insert_initiated_transaction,
+    purchase_fingerprint, transaction_fingerprint
+)
+from services.idempotency import get_response, store_response
+from services.tasks import enqueue, process_airtime_purchase
+from database import get_request_session
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 logger = logging.getLogger(__name__)
@@ -18,6 +26,43 @@ logger = logging.getLogger(__name__)
 # Create blueprint
 airtime_bp = Blueprint('airtime', __name__, url_prefix='/api/v1/airtime')
 
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Request validation tables (built once, not per request)
+_VALID_NETWORKS = frozenset(('mtn', 'glo', 'airtel', '9mobile'))
+
+
+class PurchaseAirtimeRequest(msgspec.Struct):
+    """POST /purchase body; decoded and type-checked by msgspec straight from bytes"""
+    phone: str
+    network: str
+    # The upper bound also rejects "inf"/"nan", which strict=False would accept
+    amount: Annotated[float, msgspec.Meta(gt=0, le=MAX_NAIRA_AMOUNT)]
+    amount_charged: Annotated[float, msgspec.Meta(gt=0, le=MAX_NAIRA_AMOUNT)]
+    user_id: Optional[str] = None
+    idempotency_key: Optional[str] = None
+
+
+# strict=False keeps accepting numeric strings such as "100" for amounts
+_decode_purchase = msgspec.json.Decoder(PurchaseAirtimeRequest, strict=False).decode
+
+def _provider_unavailable_response(retry_after):
+    """503 response telling the client when IA Café may be retried (nothing was recorded)"""
+    response = jsonify({
+        'success': False,
+        'message': 'Airtime provider temporarily unavailable. Please retry later.'
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+def _idempotency_mismatch_response():
+    """422 for an Idempotency-Key reused with a different purchase"""
+    return jsonify({
+        'success': False,
+        'message': 'Idempotency key was already used for a different airtime purchase request'
+    }), 422
+
 @airtime_bp.route('/purchase', methods=['POST'])
 def purchase_airtime():
     """
@@ -26,182 +71,160 @@ def purchase_airtime():
     Request Body:
     {
         "user_id": "optional_user_id",
+        "idempotency_key": "optional (or Idempotency-Key header)",
         "phone": "070XXXXXXXX",
         "network": "mtn|glo|airtel|9mobile",
         "amount": 100,
         "amount_charged": 100
     }
     
-    Response:
+    Response (202 Accepted; poll /status/<request_id> for the outcome):
     {
         "success": true,
-        "message": "Airtime purchase initiated",
+        "message": "Airtime purchase accepted for processing",
         "data": {
             "request_id": "unique_request_id",
             "transaction": {...}
         }
     }
     """
-    data = request.get_json()
-    logger.info(f"purchase_airtime request: phone={data.get('phone')}, network={data.get('network')}, amount={data.get('amount')}")
-    
-    # Validate required fields
-    required_fields = ['phone', 'network', 'amount', 'amount_charged']
-    for field in required_fields:
-        if field not in data:
-            return jsonify({
-                'success': False,
-                'message': f'Missing required field: {field}'
-            }), 400
+    # Required fields, types and 0 < amount <= MAX_NAIRA_AMOUNT are all checked by the decoder
+    try:
+        payload = _decode_purchase(request.get_data(cache=False))
+    except msgspec.DecodeError as e:
+        return jsonify({
+            'success': False,
+            'message': f'Invalid request: {e}'
+        }), 400
+    logger.info(f"purchase_airtime request: phone={payload.phone}, network={payload.network}, amount={payload.amount}")
     
-    phone = data['phone']
-    network = data['network'].lower()
-    amount = float(data['amount'])
-    amount_charged = float(data['amount_charged'])
-    user_id = data.get('user_id')
+    phone = payload.phone
+    network = payload.network.lower()
+    amount = payload.amount
+    amount_charged = payload.amount_charged
+    user_id = payload.user_id
+    idempotency_key = request.headers.get('Idempotency-Key') or payload.idempotency_key
     
     # Validate network
-    if network not in ['mtn', 'glo', 'airtel', '9mobile']:
+    if network not in _VALID_NETWORKS:
         return jsonify({
             'success': False,
             'message': 'Invalid network. Must be one of: mtn, glo, airtel, 9mobile'
         }), 400
     
-    # Validate amount
-    if amount <= 0 or amount_charged <= 0:
+    # Validate idempotency key
+    if idempotency_key is not None and len(idempotency_key) > 100:
         return jsonify({
             'success': False,
-            'message': 'Amount must be greater than 0'
+            'message': 'Idempotency key must be a string of at most 100 characters'
         }), 400
     
+    amount = to_kobo(amount)
+    amount_charged = to_kobo(amount_charged)
+    # A retry with the same key must describe the same purchase
+    fingerprint = purchase_fingerprint(phone, network, amount, amount_charged)
+    
+    # Same key seen recently in this process: replay the original response
+    if idempotency_key:
+        replay = get_response(user_id, ServiceType.AIRTIME.value, idempotency_key)
+        if replay is not None:
+            if replay[0] != fingerprint:
+                return _idempotency_mismatch_response()
+            return replay[1], replay[2], _JSON_HEADERS
+    
+    # Fail fast while IA Café is down, before recording anything: a 503
+    # leaves no transaction behind, so the client can simply retry
+    if iacafe_service.circuit_breaker.is_open():
+        logger.warning("IA Café circuit open; airtime purchase rejected")
+        return _provider_unavailable_response(iacafe_service.circuit_breaker.retry_after())
+    
     # Generate unique request ID
-    request_id = f"VECTRA_{datetime.now().strftime('%Y%m%d')}_{uuid.uuid4().hex[:12]}"
+    request_id = generate_request_id()
     
-    db: Session = next(get_db())
+    db: Session = get_request_session()
 
     # DB-first: ensure we insert transaction with INITIATED status before calling provider
     try:
-        # Check for duplicate request (idempotency)
-        existing_transaction = db.query(Transaction).filter(
-            Transaction.request_id == request_id
-        ).first()
-
-        if existing_transaction:
-            return jsonify({
-                'success': False,
-                'message': 'Duplicate request detected',
-                'data': {
-                    'request_id': request_id,
-                    'transaction': existing_transaction.to_dict()
-                }
-            }), 409
-
         # Create transaction record with INITIATED status (DB-first)
-        transaction = Transaction(
+        # Serialized once here; the row is only changed by the background worker from now on
+        tx_dict = insert_initiated_transaction(
+            db,
             request_id=request_id,
             user_id=user_id,
-            service=ServiceType.AIRTIME,
-            network=NetworkType(network),
+            idempotency_key=idempotency_key,
+            service=ServiceType.AIRTIME.value,
+            network=NetworkType(network).value,
             phone=phone,
             amount=amount,
-            amount_charged=amount_charged,
-            status=TransactionStatus.INITIATED
+            amount_charged=amount_charged
         )
 
-        db.add(transaction)
-        db.commit()
-
         logger.info(f"Created transaction INITIATED: {request_id} for {phone}")
 
-    except Exception as e:
+    except IntegrityError as e:
         db.rollback()
-        logger.error(f"Transaction creation failed (abort, no provider call): {str(e)}")
-        return jsonify({
-            'success': False,
-            'message': 'Failed to create transaction'
-        }), 500
 
-    # Move to PROCESSING before calling provider
-    try:
-        transaction = change_transaction_status(db, transaction, TransactionStatus.PROCESSING)
-    except Exception as e:
-        logger.error(f"Failed to set transaction to PROCESSING: {str(e)}")
-        return jsonify({
-            'success': False,
-            'message': 'Failed to process transaction'
-        }), 500
-
-    # Call IA Café API (sync for MVP)
-    try:
-        api_response = iacafe_service.purchase_airtime(
-            request_id=request_id,
-            phone=phone,
-            network=network,
-            amount=amount
-        )
-
-        # Store full provider response
-        transaction.provider_response = api_response
-        transaction.iacafe_reference = api_response.get('reference', '')
-        transaction.iacafe_status = api_response.get('status', '')
-        db.add(transaction)
-        db.commit()
-
-        logger.info(f"IA Café API response for {request_id}: {api_response}")
-
-        # If provider reports failure immediately, mark FAILED; otherwise keep PROCESSING
-        if not api_response.get('success'):
-            try:
-                transaction = change_transaction_status(db, transaction, TransactionStatus.FAILED)
-            except Exception:
-                # log and continue returning failure
-                logger.exception("Failed to mark transaction FAILED after provider failure")
+        # Client retry with the same Idempotency-Key: return the original transaction
+        if idempotency_key:
+            existing_transaction = get_by_idempotency_key(db, user_id, ServiceType.AIRTIME.value, idempotency_key)
+            if existing_transaction is not None:
+                if transaction_fingerprint(existing_transaction) != fingerprint:
+                    return _idempotency_mismatch_response()
+                # Never picked up (e.g. lost in a restart): queue it again; the
+                # worker locks the row, so a still-pending original job is harmless
+                if existing_transaction.status == TransactionStatus.INITIATED.value:
+                    enqueue(process_airtime_purchase, existing_transaction.request_id)
+                return jsonify({
+                    'success': True,
+                    'message': 'Airtime purchase already accepted for this idempotency key',
+                    'data': {
+                        'request_id': existing_transaction.request_id,
+                        'transaction': existing_transaction.to_dict()
+                    }
+                }), 200
 
+        # request_id is UNIQUE, so a clash means this request is already recorded
+        existing_transaction = get_by_request_id(db, request_id)
+        if existing_transaction is None:
+            logger.error(f"Transaction creation failed (abort, no provider call): {str(e)}")
             return jsonify({
                 'success': False,
-                'message': f"Airtime purchase failed: {api_response.get('message', 'Unknown error')}",
-                'data': {
-                    'request_id': request_id,
-                    'transaction': transaction.to_dict(),
-                    'api_response': api_response
-                }
-            }), 400
-
-        # Success path: don't mark SUCCESS here; webhook will confirm
+                'message': 'Failed to create transaction'
+            }), 500
+
         return jsonify({
-            'success': True,
-            'message': 'Airtime purchase initiated successfully',
+            'success': False,
+            'message': 'Duplicate request detected',
             'data': {
                 'request_id': request_id,
-                'transaction': transaction.to_dict(),
-                'api_response': api_response
+                'transaction': existing_transaction.to_dict()
             }
-        }), 200
-
-    except Exception as api_error:
-        # Provider call failed — store error and mark FAILED
-        transaction.provider_response = {'error': str(api_error)}
-        transaction.error_message = str(api_error)
-        db.add(transaction)
-        db.commit()
-
-        try:
-            transaction = change_transaction_status(db, transaction, TransactionStatus.FAILED)
-        except Exception:
-            logger.exception("Failed to mark transaction FAILED after provider exception")
-
-        logger.error(f"IA Café API error for {request_id}: {str(api_error)}")
-        logger.critical(f"REFUND REQUIRED: Transaction {request_id} failed. Amount: {amount_charged}")
+        }), 409
 
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Transaction creation failed (abort, no provider call): {str(e)}")
         return jsonify({
             'success': False,
-            'message': 'Airtime purchase failed. Please try again.',
-            'data': {
-                'request_id': request_id,
-                'transaction': transaction.to_dict()
-            }
+            'message': 'Failed to create transaction'
         }), 500
 
+    # Hand the provider call to a background worker; the client polls
+    # /status/<request_id> and the webhook confirms the final outcome
+    enqueue(process_airtime_purchase, request_id)
+
+    body = orjson.dumps({
+        'success': True,
+        'message': 'Airtime purchase accepted for processing',
+        'data': {
+            'request_id': request_id,
+            'transaction': tx_dict
+        }
+    })
+    if idempotency_key:
+        store_response(user_id, ServiceType.AIRTIME.value, idempotency_key, fingerprint, body, 202)
+    return body, 202, _JSON_HEADERS
+
 @airtime_bp.route('/status/<request_id>', methods=['GET'])
 def get_airtime_status(request_id):
     """
@@ -218,15 +241,13 @@ def get_airtime_status(request_id):
         }
     }
     """
-    db: Session = next(get_db())
+    db: Session = get_request_session()
     
     try:
-        transaction = db.query(Transaction).filter(
-            Transaction.request_id == request_id,
-            Transaction.service == ServiceType.AIRTIME
-        ).first()
+        # request_id is unique on its own; the service check happens after the fetch
+        transaction = get_by_request_id(db, request_id)
         
-        if not transaction:
+        if not transaction or transaction.service != ServiceType.AIRTIME:
             return jsonify({
                 'success': False,
                 'message': 'Transaction not found'
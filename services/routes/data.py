@@ -3,14 +3,25 @@ Data purchase routes for Vectra VTU Backend
 Handles data plan purchases and queries
 """
 from flask import Blueprint, request, jsonify
-import uuid
+import math
 import logging
-from datetime import datetime
+import msgspec
+import orjson
+import time
+from typing import Annotated, Optional
 
-from models import Transaction, TransactionStatus, ServiceType, NetworkType
+from config import config
+from models import MAX_NAIRA_AMOUNT, TransactionStatus, ServiceType, NetworkType, to_kobo
 from services.iacafe import iacafe_service
-from services.transaction_service import change_transaction_status
-from database import get_db
+from services.circuit_breaker import CircuitOpenError
+from services.transaction_service import (
+    generate_request_id, get_by_idempotency_key, get_by_request_id, insert_initiated_transaction,
+    purchase_fingerprint, transaction_fingerprint
+)
+from services.idempotency import get_response, store_response
+from services.tasks import enqueue, process_data_purchase
+from database import get_request_session
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 logger = logging.getLogger(__name__)
@@ -18,6 +29,35 @@ logger = logging.getLogger(__name__)
 # Create blueprint
 data_bp = Blueprint('data', __name__, url_prefix='/api/v1/data')
 
+# Serialized /plans/<network> responses: {network: (monotonic time, body bytes)}
+_plans_body_cache = {}
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Request validation tables (built once, not per request)
+_VALID_NETWORKS = frozenset(('mtn', 'glo', 'airtel', '9mobile'))
+_NETWORK_ID_MAP = {
+    'mtn': 1,
+    'glo': 2,
+    'airtel': 3,
+    '9mobile': 4
+}
+
+
+class PurchaseDataRequest(msgspec.Struct):
+    """POST /purchase body; decoded and type-checked by msgspec straight from bytes"""
+    phone: str
+    network: str
+    data_plan_id: Annotated[int, msgspec.Meta(gt=0, le=2 ** 31 - 1)]  # INTEGER column
+    # The upper bound also rejects "inf"/"nan", which strict=False would accept
+    amount: Annotated[float, msgspec.Meta(gt=0, le=MAX_NAIRA_AMOUNT)]
+    amount_charged: Annotated[float, msgspec.Meta(gt=0, le=MAX_NAIRA_AMOUNT)]
+    user_id: Optional[str] = None
+    idempotency_key: Optional[str] = None
+
+
+# strict=False keeps accepting numeric strings such as "100" for amounts
+_decode_purchase = msgspec.json.Decoder(PurchaseDataRequest, strict=False).decode
+
 @data_bp.route('/plans/<network>', methods=['GET'])
 def get_data_plans(network):
     """
@@ -38,40 +78,46 @@ def get_data_plans(network):
     network = network.lower()
     
     # Validate network
-    if network not in ['mtn', 'glo', 'airtel', '9mobile']:
+    if network not in _VALID_NETWORKS:
         return jsonify({
             'success': False,
             'message': 'Invalid network. Must be one of: mtn, glo, airtel, 9mobile'
         }), 400
     
     # Map network name to IA Café network ID
-    network_id_map = {
-        'mtn': 1,
-        'glo': 2,
-        'airtel': 3,
-        '9mobile': 4
-    }
+    network_id = _NETWORK_ID_MAP[network]
     
-    network_id = network_id_map[network]
+    # Serve the already-serialized body while it is fresh
+    cached = _plans_body_cache.get(network)
+    if cached and time.monotonic() - cached[0] < config.PLANS_RESPONSE_CACHE_TTL:
+        return cached[1], 200, _JSON_HEADERS
     
     try:
         # Fetch data plans from IA Café
         plans_response = iacafe_service.get_data_plans(network_id)
         
         if plans_response.get('success'):
-            return jsonify({
+            body = orjson.dumps({
                 'success': True,
                 'data': {
                     'plans': plans_response.get('data', []),
                     'network': network
                 }
-            }), 200
+            })
+            # A stale fallback copy is served but not cached
+            if not plans_response.get('stale'):
+                _plans_body_cache[network] = (time.monotonic(), body)
+            return body, 200, _JSON_HEADERS
         else:
             return jsonify({
                 'success': False,
                 'message': plans_response.get('message', 'Failed to fetch data plans')
             }), 400
             
+    except CircuitOpenError as e:
+        # No cached copy to fall back on and IA Café is short-circuited (or saturated)
+        logger.warning(f"IA Café unavailable for data plans: {str(e)}")
+        return _provider_unavailable_response(e.retry_after)
     except Exception as e:
         logger.error(f"Error fetching data plans: {str(e)}")
         return jsonify({
@@ -79,6 +125,23 @@ def get_data_plans(network):
             'message': 'Failed to fetch data plans'
         }), 500
 
+def _provider_unavailable_response(retry_after):
+    """503 response telling the client when IA Café may be retried (nothing was recorded or served)"""
+    response = jsonify({
+        'success': False,
+        'message': 'Data provider temporarily unavailable. Please retry later.'
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+def _idempotency_mismatch_response():
+    """422 for an Idempotency-Key reused with a different purchase"""
+    return jsonify({
+        'success': False,
+        'message': 'Idempotency key was already used for a different data purchase request'
+    }), 422
+
 @data_bp.route('/purchase', methods=['POST'])
 def purchase_data():
     """
@@ -87,6 +150,7 @@ def purchase_data():
     Request Body:
     {
         "user_id": "optional_user_id",
+        "idempotency_key": "optional (or Idempotency-Key header)",
         "phone": "070XXXXXXXX",
         "network": "mtn|glo|airtel|9mobile",
         "data_plan_id": 5001,
@@ -94,177 +158,154 @@ def purchase_data():
         "amount_charged": 1000
     }
     
-    Response:
+    Response (202 Accepted; poll /status/<request_id> for the outcome):
     {
         "success": true,
-        "message": "Data purchase initiated",
+        "message": "Data purchase accepted for processing",
         "data": {
             "request_id": "unique_request_id",
             "transaction": {...}
         }
     }
     """
-    data = request.get_json()
-    logger.info(f"purchase_data request: phone={data.get('phone')}, network={data.get('network')}, amount={data.get('amount')}")
-    
-    # Validate required fields
-    required_fields = ['phone', 'network', 'data_plan_id', 'amount', 'amount_charged']
-    for field in required_fields:
-        if field not in data:
-            return jsonify({
-                'success': False,
-                'message': f'Missing required field: {field}'
-            }), 400
+    # Required fields, types, 0 < amount <= MAX_NAIRA_AMOUNT and data_plan_id > 0 are all checked by the decoder
+    try:
+        payload = _decode_purchase(request.get_data(cache=False))
+    except msgspec.DecodeError as e:
+        return jsonify({
+            'success': False,
+            'message': f'Invalid request: {e}'
+        }), 400
+    logger.info(f"purchase_data request: phone={payload.phone}, network={payload.network}, amount={payload.amount}")
     
-    phone = data['phone']
-    network = data['network'].lower()
-    data_plan_id = int(data['data_plan_id'])
-    amount = float(data['amount'])
-    amount_charged = float(data['amount_charged'])
-    user_id = data.get('user_id')
+    phone = payload.phone
+    network = payload.network.lower()
+    data_plan_id = payload.data_plan_id
+    amount = payload.amount
+    amount_charged = payload.amount_charged
+    user_id = payload.user_id
+    idempotency_key = request.headers.get('Idempotency-Key') or payload.idempotency_key
     
     # Validate network
-    if network not in ['mtn', 'glo', 'airtel', '9mobile']:
+    if network not in _VALID_NETWORKS:
         return jsonify({
             'success': False,
             'message': 'Invalid network. Must be one of: mtn, glo, airtel, 9mobile'
         }), 400
     
-    # Validate amount
-    if amount <= 0 or amount_charged <= 0:
+    # Validate idempotency key
+    if idempotency_key is not None and len(idempotency_key) > 100:
         return jsonify({
             'success': False,
-            'message': 'Amount must be greater than 0'
+            'message': 'Idempotency key must be a string of at most 100 characters'
         }), 400
     
-    # Validate data plan ID
-    if data_plan_id <= 0:
-        return jsonify({
-            'success': False,
-            'message': 'Invalid data plan ID'
-        }), 400
+    amount = to_kobo(amount)
+    amount_charged = to_kobo(amount_charged)
+    # A retry with the same key must describe the same purchase
+    fingerprint = purchase_fingerprint(phone, network, amount, amount_charged, data_plan_id)
+    
+    # Same key seen recently in this process: replay the original response
+    if idempotency_key:
+        replay = get_response(user_id, ServiceType.DATA.value, idempotency_key)
+        if replay is not None:
+            if replay[0] != fingerprint:
+                return _idempotency_mismatch_response()
+            return replay[1], replay[2], _JSON_HEADERS
+    
+    # Fail fast while IA Café is down, before recording anything: a 503
+    # leaves no transaction behind, so the client can simply retry
+    if iacafe_service.circuit_breaker.is_open():
+        logger.warning("IA Café circuit open; data purchase rejected")
+        return _provider_unavailable_response(iacafe_service.circuit_breaker.retry_after())
     
     # Generate unique request ID
-    request_id = f"VECTRA_{datetime.now().strftime('%Y%m%d')}_{uuid.uuid4().hex[:12]}"
+    request_id = generate_request_id()
     
-    db: Session = next(get_db())
+    db: Session = get_request_session()
 
     # DB-first: insert INITIATED transaction
     try:
-        existing_transaction = db.query(Transaction).filter(
-            Transaction.request_id == request_id
-        ).first()
-
-        if existing_transaction:
-            return jsonify({
-                'success': False,
-                'message': 'Duplicate request detected',
-                'data': {
-                    'request_id': request_id,
-                    'transaction': existing_transaction.to_dict()
-                }
-            }), 409
-
-        transaction = Transaction(
+        # Serialized once here; the row is only changed by the background worker from now on
+        tx_dict = insert_initiated_transaction(
+            db,
             request_id=request_id,
             user_id=user_id,
-            service=ServiceType.DATA,
-            network=NetworkType(network),
+            idempotency_key=idempotency_key,
+            service=ServiceType.DATA.value,
+            network=NetworkType(network).value,
             phone=phone,
             amount=amount,
-            amount_charged=amount_charged,
-            status=TransactionStatus.INITIATED
+            data_plan_id=data_plan_id,
+            amount_charged=amount_charged
         )
 
-        db.add(transaction)
-        db.commit()
-
         logger.info(f"Created transaction INITIATED: {request_id} for {phone}")
 
-    except Exception as e:
+    except IntegrityError as e:
         db.rollback()
-        logger.error(f"Transaction creation failed (abort, no provider call): {str(e)}")
-        return jsonify({
-            'success': False,
-            'message': 'Failed to create transaction'
-        }), 500
-
-    # Transition to PROCESSING
-    try:
-        transaction = change_transaction_status(db, transaction, TransactionStatus.PROCESSING)
-    except Exception as e:
-        logger.error(f"Failed to set transaction to PROCESSING: {str(e)}")
-        return jsonify({
-            'success': False,
-            'message': 'Failed to process transaction'
-        }), 500
-
-    # Call IA Café API
-    try:
-        api_response = iacafe_service.purchase_data(
-            request_id=request_id,
-            phone=phone,
-            network=network,
-            data_plan_id=data_plan_id
-        )
-
-        transaction.provider_response = api_response
-        transaction.iacafe_reference = api_response.get('reference', '')
-        transaction.iacafe_status = api_response.get('status', '')
-        db.add(transaction)
-        db.commit()
 
-        logger.info(f"IA Café API response for {request_id}: {api_response}")
-
-        if not api_response.get('success'):
-            try:
-                transaction = change_transaction_status(db, transaction, TransactionStatus.FAILED)
-            except Exception:
-                logger.exception("Failed to mark transaction FAILED after provider failure")
+        # Client retry with the same Idempotency-Key: return the original transaction
+        if idempotency_key:
+            existing_transaction = get_by_idempotency_key(db, user_id, ServiceType.DATA.value, idempotency_key)
+            if existing_transaction is not None:
+                if transaction_fingerprint(existing_transaction) != fingerprint:
+                    return _idempotency_mismatch_response()
+                # Never picked up (e.g. lost in a restart): queue it again; the
+                # worker locks the row, so a still-pending original job is harmless
+                if existing_transaction.status == TransactionStatus.INITIATED.value:
+                    enqueue(process_data_purchase, existing_transaction.request_id)
+                return jsonify({
+                    'success': True,
+                    'message': 'Data purchase already accepted for this idempotency key',
+                    'data': {
+                        'request_id': existing_transaction.request_id,
+                        'transaction': existing_transaction.to_dict()
+                    }
+                }), 200
 
+        # request_id is UNIQUE, so a clash means this request is already recorded
+        existing_transaction = get_by_request_id(db, request_id)
+        if existing_transaction is None:
+            logger.error(f"Transaction creation failed (abort, no provider call): {str(e)}")
             return jsonify({
                 'success': False,
-                'message': f"Data purchase failed: {api_response.get('message', 'Unknown error')}",
-                'data': {
-                    'request_id': request_id,
-                    'transaction': transaction.to_dict(),
-                    'api_response': api_response
-                }
-            }), 400
+                'message': 'Failed to create transaction'
+            }), 500
 
         return jsonify({
-            'success': True,
-            'message': 'Data purchase initiated successfully',
+            'success': False,
+            'message': 'Duplicate request detected',
             'data': {
                 'request_id': request_id,
-                'transaction': transaction.to_dict(),
-                'api_response': api_response
+                'transaction': existing_transaction.to_dict()
             }
-        }), 200
-
-    except Exception as api_error:
-        transaction.provider_response = {'error': str(api_error)}
-        transaction.error_message = str(api_error)
-        db.add(transaction)
-        db.commit()
-
-        try:
-            transaction = change_transaction_status(db, transaction, TransactionStatus.FAILED)
-        except Exception:
-            logger.exception("Failed to mark transaction FAILED after provider exception")
-
-        logger.error(f"IA Café API error for {request_id}: {str(api_error)}")
-        logger.critical(f"REFUND REQUIRED: Data transaction {request_id} failed. Amount: {amount_charged}")
+        }), 409
 
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Transaction creation failed (abort, no provider call): {str(e)}")
         return jsonify({
             'success': False,
-            'message': 'Data purchase failed. Please try again.',
-            'data': {
-                'request_id': request_id,
-                'transaction': transaction.to_dict()
-            }
+            'message': 'Failed to create transaction'
         }), 500
 
+    # Hand the provider call to a background worker; the client polls
+    # /status/<request_id> and the webhook confirms the final outcome
+    enqueue(process_data_purchase, request_id)
+
+    body = orjson.dumps({
+        'success': True,
+        'message': 'Data purchase accepted for processing',
+        'data': {
+            'request_id': request_id,
+            'transaction': tx_dict
+        }
+    })
+    if idempotency_key:
+        store_response(user_id, ServiceType.DATA.value, idempotency_key, fingerprint, body, 202)
+    return body, 202, _JSON_HEADERS
+
 @data_bp.route('/status/<request_id>', methods=['GET'])
 def get_data_status(request_id):
     """
@@ -281,15 +322,13 @@ def get_data_status(request_id):
         }
     }
     """
-    db: Session = next(get_db())
+    db: Session = get_request_session()
     
     try:
-        transaction = db.query(Transaction).filter(
-            Transaction.request_id == request_id,
-            Transaction.service == ServiceType.DATA
-        ).first()
+        # request_id is unique on its own; the service check happens after the fetch
+        transaction = get_by_request_id(db, request_id)
         
-        if not transaction:
+        if not transaction or transaction.service != ServiceType.DATA:
             return jsonify({
                 'success': False,
                 'message': 'Transaction not found'
@@ -1,10 +1,15 @@
 from flask import Blueprint, jsonify, request, current_app
-from database import get_db
+from database import get_request_session
 from sqlalchemy.orm import Session
 from services.iacafe import iacafe_service
-from services.transaction_service import change_transaction_status
-from models import Transaction, TransactionStatus
+from services.circuit_breaker import CircuitOpenError
+from services.transaction_service import (
+    apply_normalized_status, compact_provider_response, get_by_request_id, set_transaction_status
+)
+from services.transaction_cache import transaction_cache
+from models import TERMINAL_STATUSES, TransactionStatus
 import logging
+import math
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
@@ -13,66 +18,94 @@ transactions_bp = Blueprint('transactions', __name__, url_prefix='/transactions'
 
 REQUERY_TIMEOUT_MINUTES = 10
 
+# States the refund endpoint can never refund
+NON_REFUNDABLE_STATUSES = frozenset((TransactionStatus.SUCCESS.value, TransactionStatus.REFUNDED.value))
+
+
+def _provider_unavailable_response(retry_after):
+    """503 response telling the client when IA Café may be retried"""
+    response = jsonify({'success': False, 'message': 'Provider temporarily unavailable. Please retry later.'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
 
 @transactions_bp.route('/requery/<request_id>', methods=['GET'])
 def requery_transaction(request_id):
-    db: Session = next(get_db())
+    db: Session = get_request_session()
     try:
-        transaction = db.query(Transaction).filter(Transaction.request_id == request_id).first()
+        transaction = get_by_request_id(db, request_id)
         if not transaction:
-            logger.warning(f"requery: transaction not found: {request_id}")
+            logger.warning("requery: transaction not found: %s", request_id)
             return jsonify({'success': False, 'message': 'Transaction not found'}), 404
 
-        logger.info(f"requery: request_id={request_id}, current_status={transaction.status}, time={datetime.utcnow().isoformat()}")
+        logger.info("requery: request_id=%s, current_status=%s", request_id, transaction.status)
 
-        if transaction.status in (TransactionStatus.SUCCESS, TransactionStatus.FAILED, TransactionStatus.REFUNDED):
-            return jsonify({'success': True, 'status': transaction.status.value, 'transaction': transaction.to_dict()}), 200
+        if transaction.status in TERMINAL_STATUSES:
+            transaction_cache.remember(request_id, transaction.id, transaction.status, transaction.webhook_delivery_id)
+            return jsonify({'success': True, 'status': transaction.status, 'transaction': transaction.to_dict()}), 200
 
         # Call provider requery
         try:
             provider_resp = iacafe_service.requery_order(request_id)
+        except CircuitOpenError as e:
+            logger.warning("requery: IA Café unavailable for %s: %s", request_id, e)
+            return _provider_unavailable_response(e.retry_after)
         except Exception as e:
-            logger.error(f"requery: provider error for {request_id}: {str(e)}")
+            logger.error("requery: provider error for %s: %s", request_id, e)
             return jsonify({'success': False, 'message': 'Provider requery failed', 'error': str(e)}), 502
 
-        # Store provider response
-        transaction.provider_response = provider_resp
+        # Re-read under a row lock (not held across the provider call): a
+        # webhook may have finished the transaction in the meantime
+        db.refresh(transaction, with_for_update=True)
+        if transaction.status in TERMINAL_STATUSES:
+            transaction_cache.remember(request_id, transaction.id, transaction.status, transaction.webhook_delivery_id)
+            return jsonify({'success': True, 'status': transaction.status, 'transaction': transaction.to_dict()}), 200
+
+        # Store provider response (essential fields only)
+        transaction.provider_response = compact_provider_response(provider_resp)
         transaction.iacafe_status = provider_resp.get('status', transaction.iacafe_status)
-        db.add(transaction)
-        db.commit()
 
-        # Normalize status and apply safe transition if needed
+        # Normalize status and apply safe transition if needed (same commit)
         normalized = iacafe_service.normalize_status(provider_resp.get('status', ''))
         try:
-            if normalized == 'SUCCESS':
-                change_transaction_status(db, transaction, TransactionStatus.SUCCESS)
-            elif normalized == 'FAILED':
-                change_transaction_status(db, transaction, TransactionStatus.FAILED)
-            # else leave as PROCESSING/INITIATED
+            # PENDING (or unknown) leaves the transaction as PROCESSING/INITIATED
+            apply_normalized_status(transaction, normalized)
         except Exception as e:
-            logger.error(f"requery: invalid transition for {request_id}: {str(e)}")
+            logger.error("requery: invalid transition for %s: %s", request_id, e)
+        # Read before the commit expires the instance (no reload just to cache it)
+        cache_values = (transaction.id, transaction.status, transaction.webhook_delivery_id)
+        db.commit()
+        transaction_cache.remember(request_id, *cache_values)
 
-        logger.info(f"requery: completed for {request_id}, provider_status={provider_resp.get('status')}")
+        logger.info("requery: completed for %s, provider_status=%s", request_id, provider_resp.get('status'))
         return jsonify({'success': True, 'transaction': transaction.to_dict(), 'provider_response': provider_resp}), 200
 
     except Exception as e:
-        logger.exception(f"requery: unexpected error for {request_id}: {str(e)}")
+        logger.exception("requery: unexpected error for %s: %s", request_id, e)
         return jsonify({'success': False, 'message': 'Internal server error'}), 500
 
 
 @transactions_bp.route('/refund/<request_id>', methods=['POST'])
 def refund_transaction(request_id):
-    db: Session = next(get_db())
-    payload = request.get_json() or {}
+    payload = request.get_json(cache=False) or {}
     reason = payload.get('reason', 'manual refund')
     refund_ref = None
 
+    # SUCCESS/REFUNDED transactions can never be refunded here; skip the lookup
+    cached = transaction_cache.get(request_id)
+    if cached is not None and cached.status in NON_REFUNDABLE_STATUSES:
+        logger.warning("refund: not allowed for %s, status=%s", request_id, cached.status)
+        return jsonify({'success': False, 'message': 'Refund not allowed for current status'}), 400
+
+    db: Session = get_request_session()
     try:
-        transaction = db.query(Transaction).filter(Transaction.request_id == request_id).first()
+        transaction = get_by_request_id(db, request_id, for_update=True)
         if not transaction:
-            logger.warning(f"refund: transaction not found: {request_id}")
+            logger.warning("refund: transaction not found: %s", request_id)
             return jsonify({'success': False, 'message': 'Transaction not found'}), 404
 
+        # Read the clock once; reused for the age check and the refund reference
         now = datetime.utcnow()
         # Allow refund only when FAILED or stuck in PROCESSING beyond timeout
         can_refund = False
@@ -85,28 +118,35 @@ def refund_transaction(request_id):
                 can_refund = True
 
         if not can_refund:
-            logger.warning(f"refund: not allowed for {request_id}, status={transaction.status}")
+            logger.warning("refund: not allowed for %s, status=%s", request_id, transaction.status)
+            transaction_cache.remember(request_id, transaction.id, transaction.status, transaction.webhook_delivery_id)
             return jsonify({'success': False, 'message': 'Refund not allowed for current status'}), 400
 
         # Perform refund logic (placeholder) — in real world call payment gateway or ledger
         # For now, set REFUNDED and store refund reference
         try:
             # if external refund API exists, call here and set refund_ref
-            change_transaction_status(db, transaction, TransactionStatus.REFUNDED)
-            refund_ref = f"REF_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{request_id[-6:]}"
-            transaction.provider_response = transaction.provider_response or {}
-            transaction.provider_response['refund_reference'] = refund_ref
-            db.add(transaction)
+            set_transaction_status(transaction, TransactionStatus.REFUNDED)
+            refund_ref = (
+                f"REF_{now.year:04d}{now.month:02d}{now.day:02d}"
+                f"{now.hour:02d}{now.minute:02d}{now.second:02d}_{request_id[-6:]}"
+            )
+            # Assign a new dict: in-place edits of a plain JSON column are not change-tracked
+            transaction.provider_response = {**(transaction.provider_response or {}), 'refund_reference': refund_ref}
+            # Status and reference go in one commit; the cache values are read
+            # before it expires the instance
+            cache_values = (transaction.id, transaction.status, transaction.webhook_delivery_id)
             db.commit()
+            transaction_cache.remember(request_id, *cache_values)
 
-            logger.info(f"refund: transaction {request_id} refunded, refund_ref={refund_ref}, reason={reason}")
+            logger.info("refund: transaction %s refunded, refund_ref=%s, reason=%s", request_id, refund_ref, reason)
             return jsonify({'success': True, 'refund_reference': refund_ref, 'transaction': transaction.to_dict()}), 200
 
         except Exception as e:
             db.rollback()
-            logger.exception(f"refund: failed for {request_id}: {str(e)}")
+            logger.exception("refund: failed for %s: %s", request_id, e)
             return jsonify({'success': False, 'message': 'Refund failed'}), 500
 
     except Exception as e:
-        logger.exception(f"refund: unexpected error for {request_id}: {str(e)}")
+        logger.exception("refund: unexpected error for %s: %s", request_id, e)
         return jsonify({'success': False, 'message': 'Internal server error'}), 500
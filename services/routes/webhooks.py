@@ -4,14 +4,15 @@ Handles IA Café webhook notifications with HMAC verification
 """
 from flask import Blueprint, request, jsonify, current_app
 import hmac
-import hashlib
-import json
 import logging
+import orjson
 from datetime import datetime
 
-from models import Transaction, TransactionStatus
-from services.transaction_service import change_transaction_status
-from database import get_db
+from models import TERMINAL_STATUSES, TransactionStatus
+from services.transaction_service import apply_normalized_status, get_by_request_id
+from services.transaction_cache import transaction_cache
+from services.idempotency import claim_delivery, release_delivery
+from database import get_request_session
 from sqlalchemy.orm import Session
 from services.iacafe import iacafe_service
 
@@ -20,6 +21,11 @@ logger = logging.getLogger(__name__)
 # Create blueprint
 webhooks_bp = Blueprint('webhooks', __name__, url_prefix='/webhooks')
 
+SUPPORTED_EVENTS = frozenset(('transaction.created', 'transaction.status_changed'))
+
+# [secret, keyed HMAC-SHA256 prototype] — key setup is done once per secret
+_hmac_proto = [None, None]
+
 def verify_webhook_signature(timestamp: str, signature: str, raw_body: bytes, secret: str) -> bool:
     """
     Verify IA Café webhook signature using HMAC-SHA256
@@ -34,19 +40,26 @@ def verify_webhook_signature(timestamp: str, signature: str, raw_body: bytes, se
         bool: True if signature is valid
     """
     try:
-        # Create expected signature
-        message = timestamp.encode() + b"." + raw_body
-        expected_signature = hmac.new(
-            secret.encode(),
-            message,
-            hashlib.sha256
-        ).hexdigest()
+        # Copy the pre-keyed OpenSSL HMAC (string digestmod) instead of
+        # re-deriving the key; the body is fed in place rather than copied
+        # into a timestamp + "." + body buffer
+        if _hmac_proto[0] != secret:
+            _hmac_proto[:] = [secret, hmac.new(secret.encode(), digestmod='sha256')]
+        mac = _hmac_proto[1].copy()
+        mac.update(timestamp.encode() + b".")
+        mac.update(raw_body)
+        expected_signature = mac.digest()
         
-        # Compare signatures (constant-time comparison for security)
-        return hmac.compare_digest(expected_signature, signature)
+        # Compare the raw 32-byte tags (constant-time comparison for security);
+        # a header that is not valid hex cannot match
+        try:
+            provided_signature = bytes.fromhex(signature)
+        except ValueError:
+            return False
+        return hmac.compare_digest(expected_signature, provided_signature)
         
     except Exception as e:
-        logger.error(f"Signature verification error: {str(e)}")
+        logger.error("Signature verification error: %s", e)
         return False
 
 @webhooks_bp.route('/iacafe', methods=['POST'])
@@ -87,15 +100,15 @@ def handle_iacafe_webhook():
     event = request.headers.get('X-VTU-Event')
     delivery_id = request.headers.get('X-VTU-Delivery')
     
-    logger.info(f"Received webhook: event={event}, delivery={delivery_id}")
+    logger.info("Received webhook: event=%s, delivery=%s", event, delivery_id)
     
     # Validate required headers
     if not all([signature, timestamp, event, delivery_id]):
-        logger.warning(f"Missing webhook headers: sig={signature}, ts={timestamp}, event={event}")
+        logger.warning("Missing webhook headers: sig=%s, ts=%s, event=%s", signature, timestamp, event)
         return jsonify({'error': 'Missing required headers'}), 400
     
-    # Get raw body for signature verification
-    raw_body = request.get_data()
+    # Read the raw body once: it is both the signed message and the JSON source
+    raw_body = request.get_data(cache=False)
     
     # Get webhook secret from config. If present, verify signature; otherwise skip signature validation.
     secret = current_app.config.get('IACAFE_WEBHOOK_SECRET')
@@ -105,28 +118,29 @@ def handle_iacafe_webhook():
             return jsonify({'error': 'Missing signature headers'}), 400
 
         if not verify_webhook_signature(timestamp, signature, raw_body, secret):
-            logger.warning(f"Invalid webhook signature: delivery={delivery_id}")
+            logger.warning("Invalid webhook signature: delivery=%s", delivery_id)
             return jsonify({'error': 'Invalid signature'}), 401
     else:
         logger.warning("Webhook secret not configured; skipping signature verification")
     
     # Parse webhook payload
     try:
-        payload = request.get_json()
-        logger.info(f"Webhook payload: {json.dumps(payload)}")
+        payload = orjson.loads(raw_body)
     except Exception as e:
-        logger.error(f"Failed to parse webhook JSON: {str(e)}")
+        logger.error("Failed to parse webhook JSON: %s", e)
         return jsonify({'error': 'Invalid JSON'}), 400
     
     # Validate webhook payload
-    if not payload or 'event' not in payload or 'data' not in payload:
-        logger.warning(f"Invalid webhook payload structure: {payload}")
+    if not isinstance(payload, dict) or 'event' not in payload or 'data' not in payload:
+        logger.warning("Invalid webhook payload structure: %s", payload)
         return jsonify({'error': 'Invalid webhook payload'}), 400
     
+    logger.info("Webhook payload size=%d event=%s", len(raw_body), payload['event'])
+    logger.debug("Webhook payload: %s", raw_body)
+    
     # Check if event is supported
-    supported_events = ['transaction.created', 'transaction.status_changed']
-    if payload['event'] not in supported_events:
-        logger.info(f"Ignoring unsupported event: {payload['event']}")
+    if payload['event'] not in SUPPORTED_EVENTS:
+        logger.info("Ignoring unsupported event: %s", payload['event'])
         return jsonify({'success': True, 'message': 'Event not supported'}), 200
     
     # Process webhook based on event type
@@ -138,54 +152,65 @@ def handle_iacafe_webhook():
             logger.warning("Webhook missing request_id")
             return jsonify({'error': 'Missing request_id'}), 400
         
-        db: Session = next(get_db())
+        # Claimed only after the signature check, so forged requests cannot
+        # burn delivery IDs; the DB webhook_delivery_id check stays as backup
+        if not claim_delivery(delivery_id):
+            logger.info("Duplicate webhook delivery %s for %s; ignoring", delivery_id, request_id)
+            return jsonify({'success': True, 'message': 'Duplicate delivery ignored'}), 200
+        
+        # Known terminal transaction: answer retries without touching the DB
+        cached = transaction_cache.get(request_id)
+        if cached is not None:
+            if delivery_id and cached.delivery_id == delivery_id:
+                logger.info("Duplicate webhook delivery %s for %s; ignoring", delivery_id, request_id)
+                return jsonify({'success': True, 'message': 'Duplicate delivery ignored'}), 200
+            if cached.status in TERMINAL_STATUSES:
+                logger.info("Transaction %s already terminal (%s); ignoring webhook", request_id, cached.status)
+                return jsonify({'success': True, 'message': 'Already terminal; ignored'}), 200
+        
+        db: Session = get_request_session()
 
-        # Find transaction by request_id
-        transaction = db.query(Transaction).filter(
-            Transaction.request_id == request_id
-        ).first()
+        # Find transaction by request_id, locked until the commit below so
+        # concurrent deliveries for it are applied one at a time
+        transaction = get_by_request_id(db, request_id, for_update=True)
 
         if not transaction:
-            logger.warning(f"Transaction not found for request_id: {request_id} — ignoring webhook")
+            logger.warning("Transaction not found for request_id: %s — ignoring webhook", request_id)
             return jsonify({'success': True, 'message': 'Transaction not found; ignored'}), 200
 
         # Idempotency: if we've already processed this delivery, ignore
         if delivery_id and transaction.webhook_delivery_id == delivery_id:
-            logger.info(f"Duplicate webhook delivery {delivery_id} for {request_id}; ignoring")
+            logger.info("Duplicate webhook delivery %s for %s; ignoring", delivery_id, request_id)
             return jsonify({'success': True, 'message': 'Duplicate delivery ignored'}), 200
 
         # If transaction already in terminal state, ignore
-        if transaction.status in (TransactionStatus.SUCCESS, TransactionStatus.FAILED):
-            logger.info(f"Transaction {request_id} already terminal ({transaction.status}); ignoring webhook")
+        if transaction.status in TERMINAL_STATUSES:
+            transaction_cache.remember(request_id, transaction.id, transaction.status, transaction.webhook_delivery_id)
+            logger.info("Transaction %s already terminal (%s); ignoring webhook", request_id, transaction.status)
             return jsonify({'success': True, 'message': 'Already terminal; ignored'}), 200
         
         # Update transaction based on webhook data
         iacafe_status = data.get('status')
         reference = data.get('reference')
         
+        normalized_status = 'N/A'
         if iacafe_status:
             transaction.iacafe_status = iacafe_status
 
             # Normalize IA Café status to internal status
             normalized_status = iacafe_service.normalize_status(iacafe_status)
 
-            # Use safe status transitions via the service
+            # Validate the transition now; it is committed with the webhook metadata below
             try:
-                if normalized_status == 'SUCCESS':
-                    change_transaction_status(db, transaction, TransactionStatus.SUCCESS)
-                    logger.info(f"Transaction {request_id} marked as SUCCESS via webhook")
-
-                elif normalized_status == 'REFUNDED':
-                    change_transaction_status(db, transaction, TransactionStatus.REFUNDED)
-                    logger.info(f"Transaction {request_id} marked as REFUNDED via webhook")
-                    logger.critical(f"REFUND PROCESS REQUIRED: Transaction {request_id} was refunded by IA Café")
-
-                elif normalized_status == 'FAILED':
-                    change_transaction_status(db, transaction, TransactionStatus.FAILED)
-                    logger.info(f"Transaction {request_id} marked as FAILED via webhook")
-                    logger.critical(f"REFUND PROCESS REQUIRED: Transaction {request_id} failed. Amount: {transaction.amount_charged}")
+                new_status = apply_normalized_status(transaction, normalized_status)
+                if new_status is not None:
+                    logger.info("Transaction %s marked as %s via webhook", request_id, new_status.value)
+                if new_status is TransactionStatus.REFUNDED:
+                    logger.critical("REFUND PROCESS REQUIRED: Transaction %s was refunded by IA Café", request_id)
+                elif new_status is TransactionStatus.FAILED:
+                    logger.critical("REFUND PROCESS REQUIRED: Transaction %s failed. Amount: %s", request_id, transaction.amount_charged / 100)
             except Exception as e:
-                logger.error(f"Invalid webhook status transition for {request_id}: {str(e)}")
+                logger.error("Invalid webhook status transition for %s: %s", request_id, e)
                 # Do not raise; webhook should be idempotent and resilient
         
         # Store webhook payload and metadata
@@ -201,9 +226,12 @@ def handle_iacafe_webhook():
         transaction.error_message = data.get('error_message', transaction.error_message)
 
         db.add(transaction)
+        # Read before the commit expires the instance (no reload just to cache it)
+        transaction_id, new_status = transaction.id, transaction.status
         db.commit()
+        transaction_cache.remember(request_id, transaction_id, new_status, delivery_id)
 
-        logger.info(f"Webhook processed successfully: request_id={request_id}, status={normalized_status if 'normalized_status' in locals() else 'N/A'}")
+        logger.info("Webhook processed successfully: request_id=%s, status=%s", request_id, normalized_status)
 
         return jsonify({
             'success': True,
@@ -212,7 +240,9 @@ def handle_iacafe_webhook():
         }), 200
         
     except Exception as e:
-        logger.error(f"Error processing webhook: {str(e)}")
+        # Let the provider's retry of this delivery be processed
+        release_delivery(delivery_id)
+        logger.error("Error processing webhook: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @webhooks_bp.route('/test', methods=['POST'])
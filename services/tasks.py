@@ -0,0 +1,176 @@
+"""
+Background purchase processing
+Provider calls run on a bounded in-process thread pool so the HTTP
+request only has to record the transaction and return 202
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import config
+from database import session_scope
+from models import TransactionStatus
+from services.iacafe import iacafe_service
+from services.circuit_breaker import CircuitOpenError
+from services.transaction_service import change_transaction_status, compact_provider_response, get_by_request_id
+
+logger = logging.getLogger(__name__)
+
+# Threads start lazily on first submit, so this is safe to build before gunicorn forks
+_executor = ThreadPoolExecutor(
+    max_workers=config.PURCHASE_WORKERS,
+    thread_name_prefix='purchase'
+)
+
+
+def _run_task(func, *args):
+    """Run a task, logging anything it raises (the Future is never inspected)"""
+    try:
+        func(*args)
+    except Exception:
+        logger.exception(f"Background task {func.__name__}{args} failed")
+
+
+def enqueue(func, *args):
+    """Schedule func(*args) on the background executor"""
+    return _executor.submit(_run_task, func, *args)
+
+
+def _retry_later(delay: float, func, *args):
+    """Enqueue func(*args) again after `delay` seconds"""
+    timer = threading.Timer(delay, enqueue, (func, *args))
+    timer.daemon = True
+    timer.start()
+
+
+def _process_purchase(request_id: str, label: str, send, job) -> None:
+    """
+    Send an INITIATED transaction to IA Café and record the outcome
+
+    Final success is confirmed later by the webhook, exactly as for
+    synchronous purchases. No DB session is held during the provider call.
+
+    Args:
+        request_id: Transaction request ID
+        label: Transaction kind used in REFUND REQUIRED alerts
+        send: Callable taking (transaction fields dict, before_send) and
+            calling IA Café
+        job: This background job, re-enqueued while IA Café's circuit is open
+    """
+    # Copy what the provider call needs, then let the connection go
+    with session_scope() as db:
+        transaction = get_by_request_id(db, request_id)
+        if transaction is None:
+            logger.error(f"Background purchase: transaction {request_id} not found")
+            return
+        if transaction.status != TransactionStatus.INITIATED:
+            logger.warning(f"Background purchase: {request_id} already {transaction.status}, skipping")
+            return
+        fields = {
+            'phone': transaction.phone,
+            'network': transaction.network,
+            'amount': transaction.amount,
+            'amount_charged': transaction.amount_charged,
+            'data_plan_id': transaction.data_plan_id,
+        }
+
+    marked = []
+
+    def mark_processing():
+        # Runs once the breaker has admitted the call, so a purchase is only
+        # moved to PROCESSING when it is actually about to be sent. The row
+        # lock makes a re-enqueued duplicate job wait here and then skip.
+        with session_scope() as db:
+            transaction = get_by_request_id(db, request_id, for_update=True)
+            if transaction is None or transaction.status != TransactionStatus.INITIATED:
+                logger.warning(f"Background purchase: {request_id} no longer INITIATED, skipping")
+                return False
+            change_transaction_status(db, transaction, TransactionStatus.PROCESSING)
+        marked.append(True)
+        return True
+
+    error_message = None
+    try:
+        api_response = send(fields, mark_processing)
+    except Exception as api_error:
+        if not marked:
+            # Nothing was sent and the row is still INITIATED, so it must not be failed
+            if isinstance(api_error, CircuitOpenError):
+                # Open circuit, or another call holds the half-open trial:
+                # keep the purchase queued until IA Café is back
+                logger.warning(f"Background purchase: IA Café unavailable, retrying {request_id} in {api_error.retry_after:.0f}s")
+                _retry_later(api_error.retry_after, job, request_id)
+            else:
+                logger.exception(f"Background purchase: {request_id} could not be sent; left INITIATED")
+            return
+        error_message = str(api_error)
+    else:
+        if api_response is None:
+            # mark_processing() declined: another job already handled it
+            return
+
+    with session_scope() as db:
+        # Re-read under a row lock: a webhook may have settled the transaction
+        # while the provider call was in flight, and its data must win
+        transaction = get_by_request_id(db, request_id, for_update=True)
+        if transaction.status != TransactionStatus.PROCESSING:
+            logger.info(f"Background purchase: {request_id} already {transaction.status}; provider result not stored")
+            return
+
+        if error_message is not None:
+            # Store error and mark FAILED in one commit
+            transaction.provider_response = {'error': error_message}
+            transaction.error_message = error_message
+            try:
+                transaction.status = TransactionStatus.FAILED
+            except ValueError:
+                logger.exception("Failed to mark transaction FAILED after provider exception")
+            db.commit()
+
+            logger.error(f"IA Café API error for {request_id}: {error_message}")
+            logger.critical(f"REFUND REQUIRED: {label} {request_id} failed. Amount: {fields['amount_charged'] / 100}")
+            return
+
+        # Store the provider response (essential fields only)
+        compact_response = compact_provider_response(api_response)
+        transaction.provider_response = compact_response
+        transaction.iacafe_reference = api_response.get('reference', '')
+        transaction.iacafe_status = api_response.get('status', '')
+
+        # If provider reports failure immediately, mark FAILED (same commit); otherwise keep PROCESSING
+        if not api_response.get('success'):
+            try:
+                transaction.status = TransactionStatus.FAILED
+            except ValueError:
+                logger.exception("Failed to mark transaction FAILED after provider failure")
+        db.commit()
+
+    logger.info("IA Café API response for %s: %s", request_id, compact_response)
+
+
+def process_airtime_purchase(request_id: str) -> None:
+    """Background job for POST /api/v1/airtime/purchase"""
+    def send(fields, before_send):
+        return iacafe_service.purchase_airtime(
+            request_id=request_id,
+            phone=fields['phone'],
+            network=fields['network'],
+            amount=fields['amount'] / 100,
+            before_send=before_send
+        )
+
+    _process_purchase(request_id, 'Transaction', send, process_airtime_purchase)
+
+
+def process_data_purchase(request_id: str) -> None:
+    """Background job for POST /api/v1/data/purchase"""
+    def send(fields, before_send):
+        return iacafe_service.purchase_data(
+            request_id=request_id,
+            phone=fields['phone'],
+            network=fields['network'],
+            data_plan_id=fields['data_plan_id'],
+            before_send=before_send
+        )
+
+    _process_purchase(request_id, 'Data transaction', send, process_data_purchase)
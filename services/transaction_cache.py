@@ -0,0 +1,57 @@
+"""
+Per-process lookup cache for terminal transactions
+Lets webhook retries and refund attempts against finished transactions
+return without a SELECT
+"""
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from config import config
+from models import TERMINAL_STATUSES
+
+
+class CachedTransaction(NamedTuple):
+    id: str
+    status: str
+    delivery_id: Optional[str]
+
+
+class TransactionCache:
+    """Thread-safe LRU of request_id -> (id, status, webhook_delivery_id)"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, request_id: str) -> Optional[CachedTransaction]:
+        with self._lock:
+            entry = self._entries.get(request_id)
+            if entry is not None:
+                self._entries.move_to_end(request_id)
+            return entry
+
+    def remember(self, request_id: str, transaction_id: str, status: str,
+                 delivery_id: Optional[str]) -> None:
+        """Cache a committed transaction if it is terminal (models.TERMINAL_STATUSES); drop any stale entry otherwise
+
+        Takes plain values rather than the Transaction, so callers can read
+        them before db.commit() expires the instance instead of reloading it.
+        """
+        if status not in TERMINAL_STATUSES:
+            self.invalidate(request_id)
+            return
+        entry = CachedTransaction(transaction_id, status, delivery_id)
+        with self._lock:
+            self._entries[request_id] = entry
+            self._entries.move_to_end(request_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, request_id: str) -> None:
+        with self._lock:
+            self._entries.pop(request_id, None)
+
+
+transaction_cache = TransactionCache(config.TRANSACTION_CACHE_SIZE)
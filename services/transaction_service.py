@@ -1,13 +1,115 @@
+import operator
+import secrets
+import time
+
+from sqlalchemy import bindparam, insert, select
 from sqlalchemy.orm import Session
-from models import Transaction, TransactionStatus
+from models import Transaction, TransactionStatus, transaction_values_to_dict
+from services.transaction_cache import transaction_cache
 
+# Built once; SQLAlchemy's compiled cache then reuses the SQL for every lookup
+_BY_REQUEST_ID = select(Transaction).where(Transaction.request_id == bindparam('request_id'))
+_BY_REQUEST_ID_FOR_UPDATE = _BY_REQUEST_ID.with_for_update()
+_BY_IDEMPOTENCY_KEY = select(Transaction).where(
+    Transaction.service == bindparam('service'),
+    Transaction.idempotency_key == bindparam('idempotency_key'),
+)
+# Separate user and guest forms, matching the unique constraint and the partial index
+_BY_USER_IDEMPOTENCY_KEY = _BY_IDEMPOTENCY_KEY.where(Transaction.user_id == bindparam('user_id'))
+_BY_GUEST_IDEMPOTENCY_KEY = _BY_IDEMPOTENCY_KEY.where(Transaction.user_id.is_(None))
+
+# Purchase fields an Idempotency-Key retry must repeat unchanged (amounts in kobo)
+_get_purchase_fingerprint = operator.attrgetter('phone', 'network', 'amount', 'amount_charged', 'data_plan_id')
+
+# Normalized IA Café status -> internal status it moves the transaction to
+# (anything else, e.g. PENDING, leaves the status unchanged)
+_NORMALIZED_STATUS_MAP = {
+    'SUCCESS': TransactionStatus.SUCCESS,
+    'FAILED': TransactionStatus.FAILED,
+    'REFUNDED': TransactionStatus.REFUNDED,
+}
+
+# [UTC day number, 'YYYYMMDD'] — the date prefix only changes once a day
+_request_id_day = [-1, '']
+
+
+def generate_request_id() -> str:
+    """Return a new `VECTRA_<YYYYMMDD UTC>_<12 hex>` request ID."""
+    now = time.time()
+    day = int(now // 86400)
+    if day != _request_id_day[0]:
+        _request_id_day[:] = [day, time.strftime('%Y%m%d', time.gmtime(now))]
+    return f"VECTRA_{_request_id_day[1]}_{secrets.token_hex(6)}"
+
+
+def get_by_request_id(db: Session, request_id: str, for_update: bool = False):
+    """Return the Transaction with this request_id, or None.
+
+    With `for_update=True` the row is locked (SELECT ... FOR UPDATE) until
+    the session commits or rolls back; SQLite ignores the lock clause.
+    """
+    stmt = _BY_REQUEST_ID_FOR_UPDATE if for_update else _BY_REQUEST_ID
+    # request_id is UNIQUE (uq_transactions_request_id), so at most one row matches
+    return db.execute(stmt, {'request_id': request_id}).scalar_one_or_none()
+
+
+def get_by_idempotency_key(db: Session, user_id, service: str, idempotency_key: str):
+    """Return the transaction created with this Idempotency-Key for the user (or guest) and service, or None."""
+    if user_id is None:
+        stmt, params = _BY_GUEST_IDEMPOTENCY_KEY, {}
+    else:
+        stmt, params = _BY_USER_IDEMPOTENCY_KEY, {'user_id': user_id}
+    params.update(service=service, idempotency_key=idempotency_key)
+    return db.execute(stmt, params).scalar_one_or_none()
+
+
+def purchase_fingerprint(phone: str, network: str, amount: int, amount_charged: int,
+                         data_plan_id=None) -> tuple:
+    """Identify a purchase request by the fields an Idempotency-Key retry must repeat."""
+    return (phone, network, amount, amount_charged, data_plan_id)
+
+
+def transaction_fingerprint(transaction: Transaction) -> tuple:
+    """`purchase_fingerprint()` of a stored transaction."""
+    return _get_purchase_fingerprint(transaction)
 
-def change_transaction_status(db: Session, transaction: Transaction, new_status: str) -> Transaction:
-    """Change `transaction.status` to `new_status` enforcing allowed transitions.
+
+def compact_provider_response(response: dict) -> dict:
+    """Keep only the IA Café response fields we act on, so rows never hold large payloads."""
+    return {
+        'reference': response.get('reference'),
+        'status': response.get('status'),
+        'success': response.get('success'),
+        'message': response.get('message'),
+    }
+
+
+def insert_initiated_transaction(db: Session, **values) -> dict:
+    """Insert a new INITIATED transaction and commit; return its `to_dict()` form.
+
+    Uses a Core INSERT ... RETURNING instead of the ORM unit of work, so
+    the model's @validates hooks do not run: callers must pass plain,
+    already-validated values (service/network strings, amounts in kobo).
+    Raises IntegrityError on a request_id or idempotency key clash.
+    """
+    values['status'] = TransactionStatus.INITIATED.value
+    row = db.execute(
+        insert(Transaction).values(**values).returning(
+            Transaction.id, Transaction.created_at, Transaction.updated_at
+        )
+    ).one()
+    db.commit()
+    values.update(row._mapping)
+    return transaction_values_to_dict(values)
+
+
+def set_transaction_status(transaction: Transaction, new_status: str) -> Transaction:
+    """Set `transaction.status` to `new_status` without committing.
 
     - `new_status` can be a `TransactionStatus` or a string matching one.
-    - This function commits the change and returns the refreshed transaction.
-    - Any invalid transition will raise a ValueError (enforced at model level).
+    - Any invalid transition will raise a ValueError (enforced at model level)
+      and leaves the status unchanged.
+    - The caller commits, together with any other field changes.
     """
     # Normalize and validate
     if isinstance(new_status, TransactionStatus):
@@ -19,7 +121,35 @@ def change_transaction_status(db: Session, transaction: Transaction, new_status:
             raise ValueError(f"Unknown status: {new_status}")
 
     transaction.status = status_val
+    return transaction
+
+
+def apply_normalized_status(transaction: Transaction, normalized: str):
+    """Set the status implied by a normalized IA Café status, without committing.
+
+    Returns the new `TransactionStatus`, or None when `normalized` does not
+    map to a status change. Invalid transitions raise ValueError.
+    """
+    new_status = _NORMALIZED_STATUS_MAP.get(normalized)
+    if new_status is not None:
+        set_transaction_status(transaction, new_status)
+    return new_status
+
+
+def change_transaction_status(db: Session, transaction: Transaction, new_status: str,
+                              refresh: bool = False) -> Transaction:
+    """Change `transaction.status` to `new_status` enforcing allowed transitions.
+
+    - Same validation as `set_transaction_status`, then commits the change
+      and returns the transaction.
+    - With `refresh=True` the row is reloaded immediately; otherwise the
+      expired attributes are only reloaded if the caller reads them.
+    """
+    request_id = transaction.request_id
+    set_transaction_status(transaction, new_status)
     db.add(transaction)
     db.commit()
-    db.refresh(transaction)
+    transaction_cache.invalidate(request_id)
+    if refresh:
+        db.refresh(transaction)
     return transaction